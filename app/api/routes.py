@@ -1,17 +1,38 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Request
+from typing import Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import json
+from app.config import settings
 from app.services.file_reader import extract_text
-from app.services.ai_service import generate_quiz
-from app.services.quiz_service import evaluate_answers, store_quiz_in_memory, get_quiz_from_memory
-from app.models.quiz import TextInput, Quiz, AnswerSubmission, QuizResult
+from app.services.ai_service import generate_quiz, generate_quiz_stream
+from app.services.generation_cache import generation_cache
+from app.services.job_queue import job_queue
+from app.services.similarity_index import similarity_index
+from app.services.quiz_service import evaluate_with_answer_key, get_answer_key, store_quiz_in_memory, get_quiz_from_memory, get_quiz_payload
+from app.services.scoring import score_submissions
+from app.models.quiz import TextInput, Quiz, AnswerSubmission, QuizResult, BatchSubmission, BatchResult
+from app.utils.deadline import parse_timeout
 
 router = APIRouter()
 
+# Characters of extracted text echoed back by /api/upload-and-generate
+TEXT_PREVIEW_CHARS = 300
+
 @router.post("/upload-file", response_model=dict)
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(
+    file: UploadFile = File(...),
+    pages: Optional[str] = Form(None),
+    max_chars: Optional[int] = Form(None)
+):
     """
     Extract text from uploaded file (PDF, DOCX, or TXT)
+    
+    Optional form fields: "pages" selects PDF pages (e.g. "3-4" or "1-5,8"),
+    "max_chars" stops extraction once enough text is collected; "truncated"
+    in the response tells whether that cut the document short.
     """
-    text = await extract_text(file)
+    text, truncated = await extract_text(file, pages=pages, max_chars=max_chars)
     
     if not text or len(text.strip()) < 10:
         raise HTTPException(
@@ -19,51 +40,345 @@ async def upload_file(file: UploadFile = File(...)):
             detail="Faylda o'qiladigan matn topilmadi. Iltimos, boshqa fayl yuklang."
         )
     
-    return {"text": text}
+    return {"text": text, "truncated": truncated}
 
 @router.post("/generate-quiz", response_model=dict)
-async def create_quiz(input_data: TextInput):
+async def create_quiz(
+    input_data: TextInput,
+    request: Request,
+    x_request_timeout: Optional[str] = Header(None)
+):
     """
     Generate quiz from provided text using AI
     Returns quiz with a unique ID
+    
+    With "background": true the generation is queued instead and a job ID is
+    returned immediately (202); poll /api/jobs/{job_id} for the result.
+    The X-Request-Timeout header (seconds) shortens the generation timeout.
+    """
+    timeout = parse_timeout(x_request_timeout, settings.GENERATION_TIMEOUT)
+    status_code, result = await _until_disconnected(request, _create_quiz(input_data, timeout))
+    if status_code != 200:
+        return JSONResponse(status_code=status_code, content=result)
+    return result
+
+@router.post("/upload-and-generate", response_model=dict)
+async def upload_and_generate(
+    request: Request,
+    file: UploadFile = File(...),
+    num_questions: int = Form(10),
+    time_per_question: int = Form(30),
+    pages: Optional[str] = Form(None),
+    max_chars: Optional[int] = Form(None),
+    full_document: bool = Form(False),
+    regenerate: bool = Form(False),
+    background: bool = Form(False),
+    include_quiz: bool = Form(True),
+    x_request_timeout: Optional[str] = Header(None)
+):
+    """
+    Extract text from an uploaded file and generate a quiz from it in one request
+    
+    Saves sending the extracted text to the client and back. The response has
+    the same fields as /api/generate-quiz plus a short "text_preview"; with
+    include_quiz=false only the quiz ID and preview are returned.
     """
+    if full_document and max_chars is None:
+        # Chunked generation covers the whole text, so don't cut it at EXTRACTION_MAX_CHARS
+        max_chars = 0
+    text, truncated = await extract_text(file, pages=pages, max_chars=max_chars)
+    
+    if not text or len(text.strip()) < 10:
+        raise HTTPException(
+            status_code=400,
+            detail="Faylda o'qiladigan matn topilmadi. Iltimos, boshqa fayl yuklang."
+        )
+    
+    input_data = TextInput(
+        text=text,
+        num_questions=num_questions,
+        time_per_question=time_per_question,
+        regenerate=regenerate,
+        full_document=full_document,
+        background=background
+    )
+    timeout = parse_timeout(x_request_timeout, settings.GENERATION_TIMEOUT)
+    status_code, result = await _until_disconnected(request, _create_quiz(input_data, timeout))
+    result["text_preview"] = text[:TEXT_PREVIEW_CHARS]
+    result["text_length"] = len(text)
+    result["truncated"] = truncated
+    if not include_quiz:
+        result.pop("quiz", None)
+    
+    if status_code != 200:
+        return JSONResponse(status_code=status_code, content=result)
+    return result
+
+async def _create_quiz(input_data: TextInput, timeout: Optional[float] = None) -> tuple:
+    """Generate (or queue) and store a quiz; returns (status code, response body)"""
     if not input_data.text or len(input_data.text.strip()) < 50:
         raise HTTPException(
             status_code=400,
             detail="Text is too short. Please provide at least 50 characters."
         )
     
+    mode = "chunked" if input_data.full_document else "single"
+    # Background callers expect a job to poll, so they always get one
+    if not input_data.regenerate and not input_data.background:
+        # A quiz made from nearly the same text (e.g. another export of the same lecture)
+        similar = await asyncio.to_thread(
+            similarity_index.find, input_data.text, input_data.num_questions, mode
+        )
+        if similar:
+            return 200, await _reuse_similar_quiz(similar, input_data)
+    
+    if input_data.background:
+        job = job_queue.submit(input_data)
+        position = job_queue.position(job)
+        return 202, {
+            **job.to_dict(),
+            "position": position,
+            "estimated_wait": job_queue.estimated_wait(position)
+        }
+    
     # Generate quiz using AI
     try:
         quiz = await generate_quiz(
             input_data.text, 
             num_questions=input_data.num_questions,
-            time_per_question=input_data.time_per_question
+            time_per_question=input_data.time_per_question,
+            use_cache=not input_data.regenerate,
+            full_document=input_data.full_document,
+            timeout=timeout
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating quiz: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
     # Store quiz and get ID
     quiz_id = store_quiz_in_memory(quiz)
+    # Only complete quizzes are offered to later requests for similar texts
+    if len(quiz.quiz) >= input_data.num_questions:
+        await asyncio.to_thread(
+            similarity_index.add, quiz_id, input_data.text, input_data.num_questions, mode
+        )
+    
+    return 200, {
+        "quiz_id": quiz_id,
+        "quiz": quiz.model_dump()
+    }
+
+async def _until_disconnected(request: Request, awaitable):
+    """
+    Await `awaitable`, cancelling it as soon as the client disconnects
     
+    The server keeps running a handler after its client has gone away;
+    cancelling stops the in-flight Gemini calls and retries nobody would read.
+    """
+    task = asyncio.ensure_future(awaitable)
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        print("DEBUG: Client disconnected, cancelling generation")
+        # 499 (client closed request) only shows up in logs and metrics
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        for pending in (task, disconnect):
+            if not pending.done():
+                pending.cancel()
+
+async def _wait_for_disconnect(request: Request):
+    # The body has been read already, so the only message left is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def _reuse_similar_quiz(similar: tuple, input_data: TextInput) -> dict:
+    """Response for a request served by an existing quiz instead of a new generation"""
+    quiz_id, similarity = similar
+    quiz = await _load_similar_quiz(similar, input_data)
     return {
         "quiz_id": quiz_id,
-        "quiz": quiz.dict()
+        "quiz": quiz.model_dump(),
+        "similar_to": {"quiz_id": quiz_id, "similarity": round(similarity, 3)}
     }
 
+async def _load_similar_quiz(similar: tuple, input_data: TextInput) -> Quiz:
+    quiz_id, similarity = similar
+    print(f"DEBUG: Reusing quiz {quiz_id} (similarity {similarity:.2f})")
+    quiz = await asyncio.to_thread(get_quiz_from_memory, quiz_id)
+    # Only this response gets the requested time; the stored quiz is left as it is
+    if quiz.time_per_question != input_data.time_per_question:
+        quiz = quiz.model_copy(update={"time_per_question": input_data.time_per_question})
+    return quiz
+
+@router.post("/generate-quiz/stream")
+async def create_quiz_stream(
+    input_data: TextInput,
+    x_request_timeout: Optional[str] = Header(None)
+):
+    """
+    Generate quiz and stream questions as NDJSON while the model is writing
+    
+    Each line is one event:
+    - {"type": "question", "index": 0, "question": {...}} as soon as a question is complete
+    - {"type": "done", "quiz_id": "...", "total": 10} once the quiz is stored
+    - {"type": "error", "status": 500, "detail": "..."} if generation fails
+    
+    A quiz made from nearly the same text is replayed the same way, with
+    "similar_to" added to the done event. X-Request-Timeout works as for
+    /api/generate-quiz.
+    """
+    if not input_data.text or len(input_data.text.strip()) < 50:
+        raise HTTPException(
+            status_code=400,
+            detail="Text is too short. Please provide at least 50 characters."
+        )
+    
+    similar = None
+    if not input_data.regenerate:
+        similar = await asyncio.to_thread(
+            similarity_index.find, input_data.text, input_data.num_questions, "single"
+        )
+    if similar:
+        similar_quiz = await _load_similar_quiz(similar, input_data)
+    
+    async def events():
+        if similar:
+            for index, question in enumerate(similar_quiz.quiz):
+                yield _ndjson({"type": "question", "index": index, "question": question.model_dump()})
+            yield _ndjson({
+                "type": "done",
+                "quiz_id": similar[0],
+                "total": len(similar_quiz.quiz),
+                "similar_to": {"quiz_id": similar[0], "similarity": round(similar[1], 3)}
+            })
+            return
+        
+        questions = []
+        try:
+            async for question in generate_quiz_stream(
+                input_data.text,
+                num_questions=input_data.num_questions,
+                use_cache=not input_data.regenerate,
+                timeout=parse_timeout(x_request_timeout, settings.GENERATION_TIMEOUT)
+            ):
+                questions.append(question)
+                yield _ndjson({"type": "question", "index": len(questions) - 1, "question": question.model_dump()})
+        except HTTPException as e:
+            yield _ndjson({"type": "error", "status": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            print(f"Error generating quiz: {e}")
+            yield _ndjson({"type": "error", "status": 500, "detail": str(e)})
+            return
+        
+        quiz = Quiz(quiz=questions, time_per_question=input_data.time_per_question)
+        quiz_id = store_quiz_in_memory(quiz)
+        if len(questions) >= input_data.num_questions:
+            await asyncio.to_thread(
+                similarity_index.add, quiz_id, input_data.text, input_data.num_questions, "single"
+            )
+        yield _ndjson({"type": "done", "quiz_id": quiz_id, "total": len(questions)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+@router.get("/jobs/stats", response_model=dict)
+async def job_queue_stats():
+    """
+    Queue depth, busy workers and estimated wait for new generation jobs
+    """
+    return job_queue.stats()
+
+@router.get("/jobs/{job_id}", response_model=dict)
+async def get_job(job_id: str):
+    """
+    Status of a background generation job, with the quiz once it is done
+    """
+    job = job_queue.get(job_id)
+    result = job.to_dict()
+    
+    if job.status == "queued":
+        position = job_queue.position(job)
+        result["position"] = position
+        result["estimated_wait"] = job_queue.estimated_wait(position)
+    elif job.status == "done":
+        result["quiz"] = get_quiz_from_memory(job.quiz_id).model_dump()
+    
+    return result
+
+@router.get("/generation-cache/stats", response_model=dict)
+async def generation_cache_stats():
+    """
+    Hit/miss counters of the quiz generation cache
+    """
+    return generation_cache.stats()
+
+@router.get("/quiz/{quiz_id}")
+async def get_quiz(quiz_id: str, request: Request, answers: bool = True):
+    """
+    Fetch a stored quiz by ID
+    
+    Responds with {"quiz_id": ..., "quiz": {...}}; answers=false leaves out
+    the correct answers (for players). Bodies are serialized once and carry a
+    strong ETag, so repeat requests with If-None-Match get an empty 304.
+    """
+    payload = get_quiz_payload(quiz_id, include_answers=answers)
+    headers = {
+        "ETag": payload.etag,
+        "Cache-Control": f"public, max-age={settings.QUIZ_HTTP_MAX_AGE}"
+    }
+    
+    if _etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=payload.body, media_type="application/json", headers=headers)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so a W/ prefix still matches
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == etag or tag == "W/" + etag for tag in candidates)
+
 @router.post("/submit-answers", response_model=QuizResult)
 async def submit_answers(quiz_id: str, submission: AnswerSubmission):
     """
     Evaluate user's answers and return score
     """
-    # Retrieve the quiz
-    quiz = get_quiz_from_memory(quiz_id)
+    # Only the correct letters are needed, not the whole quiz
+    answer_key = get_answer_key(quiz_id)
     
     # Evaluate answers
-    result = evaluate_answers(quiz, submission)
+    result = evaluate_with_answer_key(answer_key, submission)
     
     return result
+
+@router.post("/submit-answers/batch", response_model=BatchResult)
+async def submit_answers_batch(quiz_id: str, batch: BatchSubmission):
+    """
+    Score many students' answers to one quiz at once
+    
+    Returns each student's score plus per-question statistics: correct rate,
+    option distribution and discrimination index.
+    """
+    answer_key = get_answer_key(quiz_id)
+    quiz = get_quiz_from_memory(quiz_id)
+    return score_submissions(quiz, answer_key, batch.submissions)
+
 @router.post("/get-telegram-link", response_model=dict)
 async def get_telegram_link(quiz_id: str):
     """
@@ -77,3 +392,24 @@ async def get_telegram_link(quiz_id: str):
     share_link = f"https://t.me/{bot_username}?startgroup=q_{quiz_id}"
     
     return {"share_link": share_link}
+
+@router.post("/telegram/webhook", include_in_schema=False)
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None)
+):
+    """
+    Receive Telegram updates when the bot runs in webhook mode
+    """
+    from app.services.telegram_service import telegram_bot
+    
+    # Unauthenticated requests are turned away before their body is read
+    if not telegram_bot.webhook_authorized(x_telegram_bot_api_secret_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid update")
+    if not isinstance(data, dict) or not await telegram_bot.process_webhook_update(data):
+        raise HTTPException(status_code=400, detail="Invalid update")
+    return {"ok": True}
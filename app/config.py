@@ -16,16 +16,85 @@ class Settings:
 
     GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", os.getenv("OPENAI_MODEL", "gemini-2.0-flash"))
     MAX_TOKENS: int = int(os.getenv("MAX_TOKENS", "8192"))
+    # Per-key request budget (free tier flash models allow 15 requests per minute)
+    GEMINI_RPM_PER_KEY: int = int(os.getenv("GEMINI_RPM_PER_KEY", "15"))
+    # Total key/model attempts per generation and longest wait for a free key (seconds)
+    GEMINI_MAX_ATTEMPTS: int = int(os.getenv("GEMINI_MAX_ATTEMPTS", "6"))
+    GEMINI_MAX_WAIT: float = float(os.getenv("GEMINI_MAX_WAIT", "10"))
+    # host:port of a local plain-gRPC stand-in for the Gemini API (benchmarks); empty = Google
+    GEMINI_API_ENDPOINT: str = os.getenv("GEMINI_API_ENDPOINT", "")
+    
+    # Generation settings
+    # Approximate tokens of source text in a single-call prompt; the most informative passages are picked
+    GENERATION_PROMPT_TOKEN_BUDGET: int = int(os.getenv("GENERATION_PROMPT_TOKEN_BUDGET", "1000"))
+    # Characters of source text per chunk when generating from the full document
+    GENERATION_CHUNK_SIZE: int = int(os.getenv("GENERATION_CHUNK_SIZE", "4000"))
+    GENERATION_CHUNK_CONCURRENCY: int = int(os.getenv("GENERATION_CHUNK_CONCURRENCY", "4"))
+    GENERATION_MAX_QUESTIONS_PER_CALL: int = int(os.getenv("GENERATION_MAX_QUESTIONS_PER_CALL", "15"))
+    # Extra calls that ask only for questions missing from a partial or malformed response
+    GENERATION_TOPUP_ATTEMPTS: int = int(os.getenv("GENERATION_TOPUP_ATTEMPTS", "1"))
+    # Seconds a generation may take in total, retries included (0 = no limit);
+    # clients can ask for less with the X-Request-Timeout header
+    GENERATION_TIMEOUT: float = float(os.getenv("GENERATION_TIMEOUT", "120"))
+    
+    # Server settings
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
+    # Serve Prometheus metrics on /metrics
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    
+    # Background generation jobs (JOB_WORKERS is per process)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_BACKLOG: int = int(os.getenv("JOB_MAX_BACKLOG", "100"))
+    JOB_RESULT_TTL: int = int(os.getenv("JOB_RESULT_TTL", "3600"))  # Seconds finished jobs stay queryable
     
     # Telegram Settings
     TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
     TELEGRAM_BOT_USERNAME: str = os.getenv("TELEGRAM_BOT_USERNAME", "TestifyHub_bot")
     WEB_APP_URL: str = os.getenv("WEB_APP_URL", "https://s1qosimovv.github.io/testify-frontend/")
+    # Public base URL of this server; when set, the bot uses a webhook instead of polling
+    TELEGRAM_WEBHOOK_URL: str = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+    TELEGRAM_WEBHOOK_SECRET: str = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+    # Point at a local stand-in to run the bot without Telegram
+    TELEGRAM_API_BASE_URL: str = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+    # Scores of abandoned quizzes are dropped after this many idle seconds
+    TELEGRAM_RESULT_TTL: int = int(os.getenv("TELEGRAM_RESULT_TTL", str(24 * 3600)))
+    # Outgoing flood control: messages/second overall, seconds between messages per chat
+    TELEGRAM_GLOBAL_RATE: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+    TELEGRAM_PRIVATE_INTERVAL: float = float(os.getenv("TELEGRAM_PRIVATE_INTERVAL", "1.0"))
+    TELEGRAM_GROUP_INTERVAL: float = float(os.getenv("TELEGRAM_GROUP_INTERVAL", "3.0"))
     
     # File upload settings
-    MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))  # 10MB
     ALLOWED_EXTENSIONS: set = {".pdf", ".docx", ".txt"}
+    # PDF/DOCX parsing: worker processes (0 = run in a thread), concurrent parses (at most
+    # one per worker process), seconds per file
+    EXTRACTION_WORKERS: int = int(os.getenv("EXTRACTION_WORKERS", str(min(os.cpu_count() or 1, 4))))
+    EXTRACTION_MAX_CONCURRENT: int = int(os.getenv("EXTRACTION_MAX_CONCURRENT", "8"))
+    EXTRACTION_TIMEOUT: float = float(os.getenv("EXTRACTION_TIMEOUT", "30"))
+    # Stop extracting once this many characters are collected (0 = whole file)
+    EXTRACTION_MAX_CHARS: int = int(os.getenv("EXTRACTION_MAX_CHARS", "0"))
+    # Extracted text cache, keyed by a hash of the uploaded bytes
+    EXTRACTION_CACHE_DB_PATH: str = os.getenv("EXTRACTION_CACHE_DB_PATH", "extraction_cache.db")
+    EXTRACTION_CACHE_TTL: int = int(os.getenv("EXTRACTION_CACHE_TTL", str(30 * 24 * 3600)))  # 30 days, 0 = never expire
+    EXTRACTION_CACHE_MAX_BYTES: int = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))  # 200MB
+    EXTRACTION_CACHE_MEMORY_ENTRIES: int = int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", "64"))
+
+    # Quiz storage settings
+    QUIZ_DB_PATH: str = os.getenv("QUIZ_DB_PATH", "quizzes.db")
+    QUIZ_CACHE_SIZE: int = int(os.getenv("QUIZ_CACHE_SIZE", "1024"))
+    # Answer keys are a few bytes each, so many more of them stay in memory
+    QUIZ_KEY_CACHE_SIZE: int = int(os.getenv("QUIZ_KEY_CACHE_SIZE", "100000"))
+    # Cache-Control max-age of GET /api/quiz/{id} (quizzes never change once stored)
+    QUIZ_HTTP_MAX_AGE: int = int(os.getenv("QUIZ_HTTP_MAX_AGE", str(24 * 3600)))
+    # Reuse a stored quiz whose source text is at least this similar (estimated Jaccard, 0 = off)
+    SIMILARITY_THRESHOLD: float = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+    # Largest number of submissions accepted by /api/submit-answers/batch
+    BATCH_SCORING_MAX_SUBMISSIONS: int = int(os.getenv("BATCH_SCORING_MAX_SUBMISSIONS", "10000"))
+
+    # Generation cache settings (identical texts skip the Gemini call)
+    GENERATION_CACHE_DB_PATH: str = os.getenv("GENERATION_CACHE_DB_PATH", "generation_cache.db")
+    GENERATION_CACHE_TTL: int = int(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))  # 7 days, 0 = never expire
+    GENERATION_CACHE_MAX_BYTES: int = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))  # 100MB
 
 settings = Settings()
@@ -1,7 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+import time
 from app.api.routes import router
 from app.config import settings
+from app.utils.metrics import Histogram, metrics_registry
 
 app = FastAPI(
     title="QuizGen AI API",
@@ -23,14 +26,121 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+HTTP_SECONDS = Histogram(
+    "testify_http_request_duration_seconds", "API request latency", ["method", "route", "status"]
+)
+
+API_PREFIX = "/api"
+# Routes of the included API router only know their path relative to API_PREFIX
+_API_ROUTES = {id(route) for route in router.routes}
+
+def _route_label(route) -> str:
+    if route is None:
+        return "unmatched"
+    if id(route) in _API_ROUTES:
+        return API_PREFIX + route.path
+    return route.path
+
+# Multipart framing adds a little on top of the file itself
+UPLOAD_OVERHEAD = 64 * 1024
+
+class LimitUploadSize:
+    """
+    Reject oversized uploads while they are received
+
+    A Content-Length over the limit is answered before the body is read. Uploads
+    without one (chunked transfer) are counted as they arrive and cut off with
+    413 once they pass the limit, so an oversized body is never spooled whole.
+    Works on the raw ASGI receive channel, which function middlewares cannot wrap.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith("/api/upload"):
+            await self.app(scope, receive, send)
+            return
+        
+        limit = settings.MAX_FILE_SIZE + UPLOAD_OVERHEAD
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": _upload_too_large_detail()})
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        rejected = False
+        
+        async def counted_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    rejected = True
+                    response = JSONResponse(status_code=413, content={"detail": _upload_too_large_detail()})
+                    await response(scope, receive, send)
+                    # The app stops reading as if the client had gone away
+                    return {"type": "http.disconnect"}
+            return message
+        
+        async def guarded_send(message):
+            # The client already has its 413; drop the app's answer to the cut-off body
+            if not rejected:
+                await send(message)
+        
+        await self.app(scope, counted_receive, guarded_send)
+
+def _upload_too_large_detail() -> str:
+    return f"Fayl juda katta. Maksimal hajm: {settings.MAX_FILE_SIZE // (1024 * 1024)}MB."
+
+app.add_middleware(LimitUploadSize)
+
+# Registered last so it is the outermost middleware and also sees the 413s above
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    # Counted as a 500 when the app raises instead of answering
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not the raw path, to keep label values bounded
+        HTTP_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=_route_label(request.scope.get("route")),
+            status=status
+        )
+
 # Include API routes
-app.include_router(router, prefix="/api", tags=["Quiz"])
+app.include_router(router, prefix=API_PREFIX, tags=["Quiz"])
 
 from app.services.telegram_service import telegram_bot
+from app.services.job_queue import job_queue
+from app.services.file_reader import shutdown_extraction_pool
 
 @app.on_event("startup")
 async def startup_event():
-    telegram_bot.run_in_background()
+    job_queue.start()
+    if settings.TELEGRAM_WEBHOOK_URL:
+        await telegram_bot.start_webhook()
+    else:
+        telegram_bot.run_in_background()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_queue.stop()
+    if settings.TELEGRAM_WEBHOOK_URL:
+        await telegram_bot.stop_webhook()
+    else:
+        telegram_bot.release_scheduler()
+    shutdown_extraction_pool()
 
 @app.get("/")
 async def root():
@@ -41,6 +151,13 @@ async def root():
         "docs": "/docs"
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics of this process"""
+    if not settings.METRICS_ENABLED:
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 class Question(BaseModel):
     """Single quiz question model"""
@@ -19,6 +19,9 @@ class TextInput(BaseModel):
     text: str
     num_questions: int = 10
     time_per_question: int = 30
+    regenerate: bool = False  # Skip the generation cache and call the model again
+    full_document: bool = False  # Cover the whole text with parallel chunked generation
+    background: bool = False  # Queue the generation and return a job ID immediately
 
 class AnswerSubmission(BaseModel):
     """User's answers submission"""
@@ -29,3 +32,35 @@ class QuizResult(BaseModel):
     score: int
     total: int
     percentage: float
+
+class StudentSubmission(BaseModel):
+    """One student's answers in a batch"""
+    student_id: str
+    answers: Dict[int, str]
+
+class BatchSubmission(BaseModel):
+    """Answers of many students to the same quiz"""
+    submissions: List[StudentSubmission]
+
+class StudentResult(BaseModel):
+    """Score of one student in a batch"""
+    student_id: str
+    score: int
+    total: int
+    percentage: float
+
+class QuestionStats(BaseModel):
+    """How a class answered one question"""
+    index: int
+    correct_answer: str
+    correct_rate: float
+    option_distribution: Dict[str, int]  # {"A": 12, "B": 30, ...}
+    unanswered: int
+    discrimination_index: Optional[float] = None  # Upper minus lower group correct rate
+
+class BatchResult(BaseModel):
+    """Scores and item statistics of a batch"""
+    total: int
+    mean_percentage: float
+    results: List[StudentResult]
+    questions: List[QuestionStats]
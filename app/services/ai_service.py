@@ -1,28 +1,201 @@
-import google.generativeai as genai
 from fastapi import HTTPException
+from google.ai import generativelanguage as glm
 import asyncio
-import json
+import copy
 import re
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 from app.config import settings
-from app.models.quiz import Quiz
+from app.models.quiz import Question, Quiz
+from app.services.gemini_pool import gemini_pool, is_model_missing_error, is_rate_limit_error
+from app.services.generation_cache import generation_cache
+from app.services.quiz_parser import normalize_question, parse_quiz_output
+from app.utils.deadline import Deadline
+from app.utils.json_stream import JSONArrayItemParser
+from app.utils.metrics import Counter, Histogram
+from app.utils.passages import remove_boilerplate, select_passages
 
-# Configure Gemini API
-genai.configure(api_key=settings.GEMINI_API_KEY)
+class _InflightGeneration:
+    """A generation task shared by every concurrent request with the same inputs"""
+    
+    def __init__(self, deadline: Deadline):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Latest deadline of all waiters; the shared work may run until then
+        self.deadline = deadline
+
+GEMINI_SECONDS = Histogram(
+    "testify_gemini_request_duration_seconds", "Gemini call latency", ["key", "model", "outcome"]
+)
+GEMINI_ERRORS = Counter(
+    "testify_gemini_errors_total", "Failed Gemini attempts by kind (rate_limit = 429)", ["key", "model", "kind"]
+)
+GEMINI_RETRIES = Counter("testify_gemini_retries_total", "Gemini attempts after the first one of a request")
+GEMINI_FALLBACKS = Counter(
+    "testify_gemini_model_fallbacks_total", "Retries that switched to another model", ["from_model", "to_model"]
+)
+GEMINI_EXHAUSTED = Counter(
+    "testify_gemini_exhausted_total", "Requests that ran out of keys/models/attempts/time", ["status"]
+)
+QUIZ_PARSE_FAILURES = Counter(
+    "testify_quiz_parse_failures_total", "Model responses with no usable question"
+)
+QUIZ_PARSE_DROPPED = Counter(
+    "testify_quiz_parse_dropped_questions_total", "Malformed questions dropped from model output"
+)
 
-async def generate_quiz(text: str, num_questions: int = 10, time_per_question: int = 30) -> Quiz:
+# In-flight generations keyed by generation cache key
+_inflight: Dict[str, _InflightGeneration] = {}
+
+async def generate_quiz(
+    text: str,
+    num_questions: int = 10,
+    time_per_question: int = 30,
+    use_cache: bool = True,
+    full_document: bool = False,
+    timeout: Optional[float] = None
+) -> Quiz:
     """
     Generate quiz questions from text using Google Gemini API
     
+    Identical inputs are served from the generation cache without calling the API,
+    and concurrent identical requests share a single in-flight API call.
+    
     Args:
         text: Input text to generate quiz from
         num_questions: Number of questions to generate (default: 10)
+        time_per_question: Seconds per question in the Telegram sequence
+        use_cache: Set to False to bypass the cache and regenerate
+        full_document: Spread questions over the whole text in parallel chunks
+            instead of only using its beginning
+        timeout: Seconds the generation may take, retries included
+            (default: GENERATION_TIMEOUT)
         
     Returns:
         Quiz object with generated questions
         
     Raises:
-        HTTPException: If API call fails or response is invalid
+        HTTPException: If API call fails or response is invalid (504 when
+            the timeout runs out first)
+    """
+    mode = "chunked" if full_document else "single"
+    cache_key = generation_cache.make_key(text, num_questions, settings.GEMINI_MODEL, mode)
+    
+    if use_cache:
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            print(f"DEBUG: Generation cache hit ({cache_key[:12]})")
+            quiz = Quiz(**cached)
+            quiz.time_per_question = time_per_question
+            return quiz
+    
+    deadline = Deadline(settings.GENERATION_TIMEOUT if timeout is None else timeout)
+    # Every waiter receives the same shared object, so hand out a private copy
+    if full_document:
+        generate = lambda shared_deadline: _generate_quiz_chunked(text, num_questions, shared_deadline)
+    else:
+        generate = lambda shared_deadline: _generate_quiz_uncached(text, num_questions, shared_deadline)
+    quiz = (await _generate_shared(cache_key, generate, deadline, num_questions)).model_copy(deep=True)
+    quiz.time_per_question = time_per_question
+    return quiz
+
+async def _generate_shared(
+    cache_key: str,
+    generate: Callable[[Deadline], Awaitable[Quiz]],
+    deadline: Deadline,
+    num_questions: int
+) -> Quiz:
+    """
+    Join the in-flight generation for these inputs, starting one if needed
+    
+    The shared task is shielded from waiter cancellation: a client that
+    disconnects or runs out of time only stops waiting. The task runs until
+    the latest deadline of its waiters and is cancelled once the last waiter
+    is gone, since nobody would read its result.
+    """
+    flight = _inflight.get(cache_key)
+    if flight is None:
+        flight = _InflightGeneration(copy.copy(deadline))
+        flight.task = asyncio.ensure_future(
+            _generate_and_cache(cache_key, generate, flight.deadline, num_questions)
+        )
+        _inflight[cache_key] = flight
+        flight.task.add_done_callback(lambda _: _forget_inflight(cache_key, flight))
+    else:
+        print(f"DEBUG: Joining in-flight generation ({cache_key[:12]})")
+        flight.deadline.extend(deadline)
+    
+    flight.waiters += 1
+    try:
+        return await asyncio.wait_for(asyncio.shield(flight.task), deadline.timeout())
+    except asyncio.TimeoutError:
+        print(f"DEBUG: Deadline reached while waiting for generation ({cache_key[:12]})")
+        raise _deadline_exceeded()
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            print(f"DEBUG: All waiters left, cancelling generation ({cache_key[:12]})")
+            _forget_inflight(cache_key, flight)
+            flight.task.cancel()
+
+def _forget_inflight(cache_key: str, flight: _InflightGeneration):
+    if _inflight.get(cache_key) is flight:
+        del _inflight[cache_key]
+
+async def _generate_and_cache(
+    cache_key: str,
+    generate: Callable[[Deadline], Awaitable[Quiz]],
+    deadline: Deadline,
+    num_questions: int
+) -> Quiz:
+    quiz = await generate(deadline)
+    # A partial quiz (top-up failed or ran out of time) is returned but not cached,
+    # so the next identical request tries again for the full count
+    if len(quiz.quiz) >= num_questions:
+        generation_cache.put(cache_key, quiz.model_dump())
+    else:
+        print(f"DEBUG: Not caching partial quiz ({len(quiz.quiz)}/{num_questions} questions)")
+    return quiz
+
+async def _generate_quiz_uncached(text: str, num_questions: int, deadline: Deadline) -> Quiz:
+    """Generate a quiz from the most informative passages of the text with a single Gemini call"""
+    
+    if not settings.GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="Gemini API key not configured (GEMINI_API_KEY)"
+        )
+    
+    # Scoring passages is CPU-bound and takes a while on long documents
+    passages = await asyncio.to_thread(select_passages, text, settings.GENERATION_PROMPT_TOKEN_BUDGET)
+    return await _generate_questions(passages, num_questions, deadline)
+
+async def generate_quiz_stream(
+    text: str,
+    num_questions: int = 10,
+    use_cache: bool = True,
+    timeout: Optional[float] = None
+) -> AsyncIterator[Question]:
+    """
+    Generate quiz questions with a streaming Gemini call
+    
+    Each question is yielded as soon as its JSON object is complete in the
+    stream, so clients can show the first question long before the model has
+    finished. Uses the same prompt and generation cache entry as
+    generate_quiz() without full_document, and the same timeout.
+    
+    Raises:
+        HTTPException: If API call fails or no valid question was produced
     """
+    cache_key = generation_cache.make_key(text, num_questions, settings.GEMINI_MODEL, "single")
+    
+    if use_cache:
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            print(f"DEBUG: Generation cache hit ({cache_key[:12]})")
+            for question in Quiz(**cached).quiz:
+                yield question
+            return
     
     if not settings.GEMINI_API_KEY:
         raise HTTPException(
@@ -30,8 +203,89 @@ async def generate_quiz(text: str, num_questions: int = 10, time_per_question: i
             detail="Gemini API key not configured (GEMINI_API_KEY)"
         )
     
+    deadline = Deadline(settings.GENERATION_TIMEOUT if timeout is None else timeout)
+    passages = await asyncio.to_thread(select_passages, text, settings.GENERATION_PROMPT_TOKEN_BUDGET)
+    prompt = _build_prompt(passages, num_questions)
+    parser = JSONArrayItemParser("quiz")
+    questions = []
+    async for piece in _stream_gemini(prompt, deadline):
+        for item in parser.feed(piece):
+            question = normalize_question(item)
+            if question is None:
+                QUIZ_PARSE_DROPPED.inc()
+                print("DEBUG: Skipping malformed streamed question")
+                continue
+            questions.append(question)
+            yield question
+    
+    if not questions:
+        raise HTTPException(status_code=500, detail="AI model xatosi: javobda savollar topilmadi")
+    # Streamed questions cannot be topped up; a short quiz is kept out of the cache
+    if len(questions) >= num_questions:
+        generation_cache.put(cache_key, Quiz(quiz=questions).model_dump())
+    else:
+        print(f"DEBUG: Not caching partial quiz ({len(questions)}/{num_questions} questions)")
+
+async def _generate_questions(text: str, num_questions: int, deadline: Deadline) -> Quiz:
+    """
+    Build the prompt for one piece of text, call Gemini and parse the quiz
+    
+    Malformed or truncated output is salvaged question by question. If fewer
+    than `num_questions` usable questions come back, only the missing ones are
+    requested again (up to GENERATION_TOPUP_ATTEMPTS extra calls, and only
+    while the deadline leaves time for one). If the count still falls short,
+    the partial quiz is returned; it is then neither cached nor indexed.
+    """
+    questions: List[Question] = []
+    seen = set()
+    last_error = None
+    
+    for attempt in range(1 + settings.GENERATION_TOPUP_ATTEMPTS):
+        missing = num_questions - len(questions)
+        if missing <= 0:
+            break
+        if attempt > 0:
+            if not _budget_allows_call(deadline):
+                print(f"DEBUG: No time left to request {missing} missing question(s)")
+                break
+            print(f"DEBUG: Requesting {missing} missing question(s)")
+        prompt = _build_prompt(text, missing, avoid=[q.question for q in questions])
+        try:
+            content = await _call_gemini(prompt, deadline)
+        except HTTPException as e:
+            # Keep a partial quiz rather than failing the whole generation
+            if questions:
+                print(f"DEBUG: Top-up call failed, returning {len(questions)} questions: {e.detail}")
+                break
+            raise
+        
+        parsed, dropped = parse_quiz_output(content)
+        if dropped:
+            QUIZ_PARSE_DROPPED.inc(dropped)
+        if not parsed:
+            QUIZ_PARSE_FAILURES.inc()
+        if dropped or not parsed:
+            print(f"DEBUG: Salvaged {len(parsed)} question(s) from model output, dropped {dropped}")
+        if not parsed:
+            last_error = content[:200]
+        for question in parsed:
+            fingerprint = _question_fingerprint(question)
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                questions.append(question)
+    
+    if not questions:
+        print(f"DEBUG: Quiz Generation Error. No usable questions in: {last_error!r}")
+        raise HTTPException(status_code=500, detail="AI model xatosi: javobda savollar topilmadi")
+    
+    return Quiz(quiz=questions[:num_questions])
+
+def _question_fingerprint(question: Question) -> str:
+    return re.sub(r"\W+", " ", question.question).strip().lower()
+
+def _build_prompt(text: str, num_questions: int, avoid: List[str] = ()) -> str:
     # Create production-ready prompt for quiz generation
-    prompt = f"""Sen professional o'qituvchi va test tuzuvchi sun'iy intellektsan.
+    return f"""Sen professional o'qituvchi va test tuzuvchi sun'iy intellektsan.
 
 Vazifa:
 Quyidagi matn asosida quiz tuz.
@@ -68,103 +322,328 @@ JSON FORMAT (ANIQ SHU KO'RINISHDA):
   ]
 }}
 
-MATN:
-{text[:4000]}
+{_avoid_section(avoid)}MATN:
+{text}
 """
+
+def _avoid_section(questions: List[str]) -> str:
+    # Only used for top-up calls, so the regular prompt stays unchanged
+    if not questions:
+        return ""
+    listed = "\n".join(f"- {q}" for q in questions)
+    return f"QUYIDAGI SAVOLLARNI TAKRORLAMA (ular allaqachon bor):\n{listed}\n\n"
+
+async def _generate_quiz_chunked(text: str, num_questions: int, deadline: Deadline) -> Quiz:
+    """
+    Generate a quiz covering the whole text
     
-    # Parse JSON
-    try:
-        # Try a list of models in order of preference for speed and rate limits
-        # gemini-1.5-flash is usually the fastest and most stable for free tier
-        models_to_try = ["gemini-1.5-flash", "gemini-1.5-flash-8b", "gemini-2.0-flash-exp", "gemini-1.5-pro"]
-        
-        # If user has a specific model in settings, try it first
-        if settings.GEMINI_MODEL and settings.GEMINI_MODEL not in models_to_try:
-            models_to_try.insert(0, settings.GEMINI_MODEL)
-            
-        content = None
-        last_error = ""
-        is_rate_limit = False
+    The text is split into section-aware chunks, the question count is spread
+    over them and every chunk is sent to Gemini concurrently (bounded by
+    GENERATION_CHUNK_CONCURRENCY). Results are merged and deduplicated.
+    If some chunk calls fail, the questions of the others are returned as a
+    partial quiz, which _generate_and_cache() does not cache.
+    """
+    if not settings.GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="Gemini API key not configured (GEMINI_API_KEY)"
+        )
+    
+    # Running headers and tables of contents would only waste chunk space; both steps
+    # scan the whole document, so they run off the event loop
+    chunks = await asyncio.to_thread(
+        lambda: _split_into_chunks(remove_boilerplate(text), settings.GENERATION_CHUNK_SIZE)
+    )
+    jobs = _plan_chunk_jobs(chunks, num_questions, settings.GENERATION_MAX_QUESTIONS_PER_CALL)
+    if len(jobs) <= 1:
+        return await _generate_quiz_uncached(text, num_questions, deadline)
+    print(f"DEBUG: Generating {num_questions} questions from {len(chunks)} chunks in {len(jobs)} calls")
+    
+    semaphore = asyncio.Semaphore(settings.GENERATION_CHUNK_CONCURRENCY)
+    
+    async def run(chunk: str, count: int):
+        async with semaphore:
+            return await _generate_questions(chunk, count, deadline)
+    
+    results = await asyncio.gather(
+        *(run(chunk, count) for chunk, count in jobs),
+        return_exceptions=True
+    )
+    
+    questions = []
+    seen = set()
+    errors = []
+    for result in results:
+        if isinstance(result, BaseException):
+            errors.append(result)
+            continue
+        for question in result.quiz:
+            fingerprint = _question_fingerprint(question)
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            questions.append(question)
+    
+    if not questions:
+        # Every chunk failed: surface the first error as-is
+        raise errors[0]
+    if errors:
+        print(f"DEBUG: {len(errors)} of {len(jobs)} chunk calls failed, returning partial quiz (not cached)")
+    
+    return Quiz(quiz=questions[:num_questions])
+
+def _split_into_chunks(text: str, chunk_size: int) -> List[str]:
+    """
+    Split text into chunks of at most `chunk_size` characters
+    
+    Paragraph boundaries are kept where possible, a heading-like line starts a
+    new chunk once the current one is half full, and oversized paragraphs are
+    split at sentence boundaries.
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            for start in range(0, len(sentence), chunk_size):
+                pieces.append(sentence[start:start + chunk_size])
+    
+    chunks = []
+    current = []
+    size = 0
+    for piece in pieces:
+        is_heading = len(piece) < 80 and "\n" not in piece and not piece.endswith((".", "!", "?", ":", ","))
+        if current and (size + len(piece) + 1 > chunk_size or (is_heading and size > chunk_size // 2)):
+            chunks.append("\n".join(current))
+            current = []
+            size = 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def _plan_chunk_jobs(chunks: List[str], num_questions: int, max_per_call: int) -> List[tuple]:
+    """
+    Distribute `num_questions` over the chunks as (chunk, count) calls
+    
+    With more chunks than questions, evenly spaced chunks get one question
+    each; otherwise counts are proportional to chunk length. No call asks for
+    more than `max_per_call` questions, so each response fits the output limit.
+    """
+    if not chunks or num_questions <= 0:
+        return []
+    
+    if len(chunks) >= num_questions:
+        step = len(chunks) / num_questions
+        counts = [(chunks[int(i * step)], 1) for i in range(num_questions)]
+    else:
+        total = sum(len(chunk) for chunk in chunks)
+        spare = num_questions - len(chunks)
+        shares = [spare * len(chunk) / total for chunk in chunks]
+        extra = [int(share) for share in shares]
+        # Largest remainder rounding so the counts add up exactly
+        by_remainder = sorted(range(len(chunks)), key=lambda i: shares[i] - extra[i], reverse=True)
+        for i in by_remainder[:spare - sum(extra)]:
+            extra[i] += 1
+        counts = [(chunk, 1 + extra[i]) for i, chunk in enumerate(chunks)]
+    
+    jobs = []
+    for chunk, count in counts:
+        while count > 0:
+            jobs.append((chunk, min(count, max_per_call)))
+            count -= max_per_call
+    return jobs
+
+async def _call_gemini(prompt: str, deadline: Deadline) -> str:
+    """
+    Send a prompt to Gemini through the shared key/model pool
+    
+    Each attempt gets its own key and model from the pool. Rate-limited keys
+    go on cooldown and missing models are skipped, so retries move straight
+    to the next healthy pair instead of sleeping. Waiting for a key, each call
+    and the retries all stay within `deadline`; a retry is skipped when the
+    time left is shorter than a typical call.
+    
+    Raises:
+        HTTPException: 429 if every key is out of quota, 504 when the deadline
+            passes, 500 on other failures
+    """
+    if not gemini_pool.keys:
+        raise HTTPException(status_code=500, detail="API keys not configured")
+    
+    last_error = ""
+    is_rate_limit = False
+    previous_model = None
+    
+    for attempt in range(settings.GEMINI_MAX_ATTEMPTS):
+        if deadline.expired():
+            GEMINI_EXHAUSTED.inc(status=504)
+            raise _deadline_exceeded()
+        if attempt > 0 and not _budget_allows_call(deadline):
+            print(f"DEBUG: Only {deadline.remaining():.1f}s left, not enough for another attempt")
+            break
+        lease = await gemini_pool.acquire(max_wait=min(settings.GEMINI_MAX_WAIT, deadline.remaining()))
+        if lease is None:
+            is_rate_limit = is_rate_limit or bool(gemini_pool.available_models())
+            break
+        key, model = lease
+        _count_attempt(attempt, previous_model, model)
+        previous_model = model
+        started = time.perf_counter()
         
-        # Get available keys
-        api_keys = settings.GEMINI_API_KEYS
-        if not api_keys:
-             raise HTTPException(status_code=500, detail="API keys not configured")
-
-        # Try each API Key
-        for key_index, api_key in enumerate(api_keys):
-            print(f"DEBUG: Using API Key #{key_index + 1} ({api_key[:5]}...)")
-            genai.configure(api_key=api_key)
-            
-            # Try models with this key
-            for model_name in models_to_try:
-                # For each model, try up to 2 times with backoff
-                for attempt in range(2):
-                    try:
-                        print(f"DEBUG: [Key #{key_index+1}] Trying {model_name} (Attempt {attempt + 1})...")
-                        model = genai.GenerativeModel(model_name)
-                        # Set generation config to ensure JSON response
-                        generation_config = genai.GenerationConfig(
-                            response_mime_type="application/json"
-                        )
-                        
-                        response = await model.generate_content_async(
-                            prompt, 
-                            generation_config=generation_config
-                        )
-                        content = response.text
-                        if content:
-                            print(f"DEBUG: Success with {model_name} on Key #{key_index+1}")
-                            break
-                    except Exception as e:
-                        last_error = str(e)
-                        print(f"DEBUG: [Key #{key_index+1}] Model {model_name} attempt {attempt+1} failed: {last_error}")
-                        
-                        if "429" in last_error or "quota" in last_error.lower() or "resource" in last_error.lower():
-                            is_rate_limit = True
-                            # If we have more keys, break model loop and switch key immediately
-                            if key_index < len(api_keys) - 1:
-                                print(f"DEBUG: Key #{key_index+1} exhausted. Switching to next key...")
-                                break # Break model loop, continue to next key
-                            
-                            # If no more keys, wait and retry current key
-                            wait_time = 2 ** (attempt + 1)
-                            print(f"DEBUG: Rate limit on final key. Waiting {wait_time}s...")
-                            await asyncio.sleep(wait_time)
-                        else:
-                            # If it's not a rate limit (e.g. model not found), switch to next model immediately
-                            break
-                
-                if content: break # Break model loop
-                if is_rate_limit and key_index < len(api_keys) - 1: break # Break model loop to switch key
-
-            if content: break # Break key loop
-
-        if not content:
-            if is_rate_limit:
-                raise HTTPException(
-                    status_code=429, 
-                    detail="⚠️ Barcha serverlar band (Kunlik limit tugadi). Iltimos, ertaga urinib ko'ring yoki developer bilan bog'laning."
-                )
-            raise HTTPException(status_code=500, detail=f"AI xatosi: {last_error[:100]}")
-
-        # Clean up Markdown code blocks
-        if "```json" in content:
-            content = content.replace("```json", "").replace("```", "")
-        elif "```" in content:
-            content = content.replace("```", "")
-        content = content.strip()
+        try:
+            print(f"DEBUG: [{key.label}] Trying {model.name} (Attempt {attempt + 1})...")
+            # The gRPC timeout stops the call on Google's side too
+            response = await asyncio.wait_for(
+                key.client().generate_content(
+                    gemini_pool.content_request(model, prompt, _json_generation_config()),
+                    **_request_options(deadline)
+                ),
+                deadline.timeout()
+            )
+            content = _response_text(response)
+            duration = time.perf_counter() - started
+            gemini_pool.report_success(key, model, duration)
+            GEMINI_SECONDS.observe(duration, key=key.label, model=model.name, outcome="ok")
+            if content:
+                print(f"DEBUG: Success with {model.name} on {key.label}")
+                return content
+        except Exception as e:
+            GEMINI_SECONDS.observe(time.perf_counter() - started, key=key.label, model=model.name, outcome="error")
+            if deadline.expired():
+                # Not the key's or model's fault, so nothing is reported to the pool
+                raise _deadline_exceeded_during(key, model)
+            last_error = str(e)
+            is_rate_limit = _report_gemini_error(key, model, attempt, e) or is_rate_limit
+    
+    raise _gemini_failure(is_rate_limit, last_error)
+
+async def _stream_gemini(prompt: str, deadline: Deadline) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of _call_gemini(), yielding text as it arrives
+    
+    Failed attempts are retried on the next key/model pair only while nothing
+    has been yielded yet; an error after the first piece is raised as-is.
+    The gRPC timeout of each attempt ends the stream at the deadline.
+    """
+    if not gemini_pool.keys:
+        raise HTTPException(status_code=500, detail="API keys not configured")
+    
+    last_error = ""
+    is_rate_limit = False
+    previous_model = None
+    
+    for attempt in range(settings.GEMINI_MAX_ATTEMPTS):
+        if deadline.expired():
+            GEMINI_EXHAUSTED.inc(status=504)
+            raise _deadline_exceeded()
+        if attempt > 0 and not _budget_allows_call(deadline):
+            print(f"DEBUG: Only {deadline.remaining():.1f}s left, not enough for another attempt")
+            break
+        lease = await gemini_pool.acquire(max_wait=min(settings.GEMINI_MAX_WAIT, deadline.remaining()))
+        if lease is None:
+            is_rate_limit = is_rate_limit or bool(gemini_pool.available_models())
+            break
+        key, model = lease
+        _count_attempt(attempt, previous_model, model)
+        previous_model = model
+        started = time.perf_counter()
         
-        quiz_data = json.loads(content)
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"DEBUG: Quiz Generation Error. Details: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"AI model xatosi: {str(e)}")
-    
-    # Validate and return as Quiz model
-    quiz = Quiz(**quiz_data)
-    quiz.time_per_question = time_per_question
-    return quiz
+        delivered = False
+        try:
+            print(f"DEBUG: [{key.label}] Streaming {model.name} (Attempt {attempt + 1})...")
+            response = await asyncio.wait_for(
+                key.client().stream_generate_content(
+                    gemini_pool.content_request(model, prompt, _json_generation_config()),
+                    **_request_options(deadline)
+                ),
+                deadline.timeout()
+            )
+            async for chunk in response:
+                piece = _response_text(chunk)
+                if piece:
+                    delivered = True
+                    yield piece
+            duration = time.perf_counter() - started
+            gemini_pool.report_success(key, model, duration)
+            GEMINI_SECONDS.observe(duration, key=key.label, model=model.name, outcome="ok")
+            if delivered:
+                return
+        except Exception as e:
+            GEMINI_SECONDS.observe(time.perf_counter() - started, key=key.label, model=model.name, outcome="error")
+            if deadline.expired():
+                raise _deadline_exceeded_during(key, model)
+            last_error = str(e)
+            is_rate_limit = _report_gemini_error(key, model, attempt, e) or is_rate_limit
+            if delivered:
+                raise HTTPException(status_code=500, detail=f"AI xatosi: {last_error[:100]}")
+    
+    raise _gemini_failure(is_rate_limit, last_error)
+
+def _budget_allows_call(deadline: Deadline) -> bool:
+    # Starting a call that can't finish in time would only burn quota
+    return deadline.covers(gemini_pool.typical_latency())
+
+def _request_options(deadline: Deadline) -> dict:
+    timeout = deadline.timeout()
+    return {"timeout": timeout} if timeout is not None else {}
+
+def _json_generation_config() -> glm.GenerationConfig:
+    # Set generation config to ensure JSON response
+    return glm.GenerationConfig(response_mime_type="application/json")
 
+def _response_text(response: glm.GenerateContentResponse) -> str:
+    # Responses and stream chunks without parts (e.g. the final finish_reason chunk) have no text
+    if not response.candidates:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts)
 
+def _count_attempt(attempt: int, previous_model, model):
+    if attempt == 0:
+        return
+    GEMINI_RETRIES.inc()
+    if previous_model is not None and previous_model is not model:
+        GEMINI_FALLBACKS.inc(from_model=previous_model.name, to_model=model.name)
+
+def _report_gemini_error(key, model, attempt: int, error: Exception) -> bool:
+    """Record a failed attempt in the pool; returns True for rate limit errors"""
+    message = str(error)
+    print(f"DEBUG: [{key.label}] Model {model.name} attempt {attempt + 1} failed: {message}")
+    
+    if is_rate_limit_error(message):
+        GEMINI_ERRORS.inc(key=key.label, model=model.name, kind="rate_limit")
+        gemini_pool.report_rate_limit(key, error)
+        return True
+    if is_model_missing_error(message):
+        GEMINI_ERRORS.inc(key=key.label, model=model.name, kind="model_missing")
+        gemini_pool.report_model_missing(model)
+    else:
+        GEMINI_ERRORS.inc(key=key.label, model=model.name, kind="error")
+        gemini_pool.report_failure(key, model)
+    return False
+
+def _deadline_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=504,
+        detail="So'rov vaqti tugadi: AI belgilangan vaqt ichida javob bermadi. Iltimos, qayta urinib ko'ring."
+    )
+
+def _deadline_exceeded_during(key, model) -> HTTPException:
+    print(f"DEBUG: [{key.label}] Deadline reached during {model.name} call")
+    GEMINI_ERRORS.inc(key=key.label, model=model.name, kind="deadline")
+    GEMINI_EXHAUSTED.inc(status=504)
+    return _deadline_exceeded()
+
+def _gemini_failure(is_rate_limit: bool, last_error: str) -> HTTPException:
+    GEMINI_EXHAUSTED.inc(status=429 if is_rate_limit else 500)
+    if is_rate_limit:
+        return HTTPException(
+            status_code=429, 
+            detail="⚠️ Barcha serverlar band (Kunlik limit tugadi). Iltimos, ertaga urinib ko'ring yoki developer bilan bog'laning."
+        )
+    return HTTPException(status_code=500, detail=f"AI xatosi: {last_error[:100]}")
@@ -0,0 +1,46 @@
+"""
+Cache of extracted document text keyed by a hash of the uploaded bytes
+"""
+from typing import Optional
+
+from app.config import settings
+from app.utils.cache import LRUCache
+from app.utils.disk_cache import DiskCache
+
+
+class ExtractionCache(DiskCache):
+    """
+    Extracted text on disk, with an in-memory LRU of recent entries in front
+    so re-uploads of a popular file skip both parsing and the database.
+    """
+
+    def __init__(self, db_path: str, ttl: int, max_bytes: int, memory_entries: int):
+        super().__init__(db_path, ttl, max_bytes, table="extractions")
+        self.memory = LRUCache(memory_entries)
+
+    @staticmethod
+    def make_key(content_hash: str, extension: str, pages: Optional[str], max_chars: int) -> str:
+        return f"{content_hash}:{extension}:{pages or ''}:{max_chars}"
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.memory.get(key)
+        if text is not None:
+            self._count(hit=True)
+            return text
+        text = self.get_raw(key)
+        if text is not None:
+            self.memory.put(key, text)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        self.memory.put(key, text)
+        self.put_raw(key, text)
+
+
+# Global instance
+extraction_cache = ExtractionCache(
+    settings.EXTRACTION_CACHE_DB_PATH,
+    ttl=settings.EXTRACTION_CACHE_TTL,
+    max_bytes=settings.EXTRACTION_CACHE_MAX_BYTES,
+    memory_entries=settings.EXTRACTION_CACHE_MEMORY_ENTRIES
+)
@@ -1,43 +1,114 @@
 from fastapi import UploadFile, HTTPException
 import fitz  # PyMuPDF
 from docx import Document
-import io
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Callable, List, Optional, Tuple
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import tempfile
+import time
+from app.config import settings
+from app.services.extraction_cache import extraction_cache
+from app.utils.helpers import validate_file_extension
+from app.utils.metrics import Histogram
 
-async def extract_text(file: UploadFile) -> str:
+# Uploads are hashed and copied in pieces of this size, never read into memory whole
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Expected leading bytes per file type (DOCX is a ZIP archive)
+MAGIC_BYTES = {
+    ".pdf": b"%PDF-",
+    ".docx": b"PK\x03\x04",
+}
+
+UPLOAD_SIZE = Histogram(
+    "testify_upload_size_bytes", "Size of uploaded files", ["file_type"],
+    buckets=(10_000, 100_000, 500_000, 1_000_000, 2_000_000, 5_000_000, 10_000_000, 20_000_000)
+)
+EXTRACTION_SECONDS = Histogram(
+    "testify_extraction_duration_seconds", "Text extraction time per uploaded file", ["file_type", "cache"]
+)
+
+# CPU-bound PDF/DOCX parsing runs in worker processes so it never blocks the event loop.
+# Workers are spawned, not forked: by the time the first file is parsed the process
+# already runs gRPC, job worker and Telegram threads, and forking a threaded process
+# can leave locks held forever in the child.
+_mp_context = multiprocessing.get_context("spawn")
+_pool: Optional[ProcessPoolExecutor] = None
+# Every pool worker reports its PID here on startup, so a stuck pool can be killed
+_worker_pids = None
+_parse_slots: Optional[asyncio.Semaphore] = None
+
+async def extract_text(
+    file: UploadFile,
+    pages: Optional[str] = None,
+    max_chars: Optional[int] = None
+) -> Tuple[str, bool]:
     """
     Extract text from uploaded file (PDF, DOCX, or TXT)
     
+    Re-uploads of the same bytes are served from the extraction cache.
+    
     Args:
         file: Uploaded file object
+        pages: Optional 1-based PDF page selection such as "3-4" or "1-5,8"
+        max_chars: Stop extracting once this many characters are collected
+            (default: EXTRACTION_MAX_CHARS, 0 = no limit)
         
     Returns:
-        Extracted text as string
+        Extracted text and whether it was cut at max_chars
         
     Raises:
-        HTTPException: If file type is unsupported or extraction fails
+        HTTPException: If file type is unsupported, the file is too large or
+            extraction fails
     """
+    # Get file extension
+    filename = (file.filename or "").lower()
+    if not validate_file_extension(filename, settings.ALLOWED_EXTENSIONS):
+        raise HTTPException(
+            status_code=400,
+            detail="Unsupported file type. Please upload PDF, DOCX, or TXT file."
+        )
+    extension = os.path.splitext(filename)[1]
+    page_ranges = parse_page_range(pages) if pages else None
+    if max_chars is None:
+        max_chars = settings.EXTRACTION_MAX_CHARS
+    # One character over the budget tells a cut document from one that just fits
+    budget = max_chars + 1 if max_chars else 0
+    
+    content_hash = await asyncio.to_thread(_inspect_upload, file.file, extension)
+    started = time.perf_counter()
+    path = None
     try:
-        # Get file extension
-        filename = file.filename.lower()
-        content = await file.read()
+        cache_key = extraction_cache.make_key(content_hash, extension, pages, max_chars)
+        text = extraction_cache.get(cache_key)
+        if text is not None:
+            EXTRACTION_SECONDS.observe(time.perf_counter() - started, file_type=extension, cache="hit")
+            return _truncate(text, max_chars)
         
         # PDF processing
-        if filename.endswith('.pdf'):
-            return _extract_from_pdf(content)
+        if extension == '.pdf':
+            path = await asyncio.to_thread(_copy_upload, file.file, extension)
+            text = await _run_parser(_extract_from_pdf, path, budget, page_ranges)
         
         # DOCX processing
-        elif filename.endswith('.docx'):
-            return _extract_from_docx(content)
+        elif extension == '.docx':
+            path = await asyncio.to_thread(_copy_upload, file.file, extension)
+            text = await _run_parser(_extract_from_docx, path, budget)
         
         # TXT processing
-        elif filename.endswith('.txt'):
-            return _extract_from_txt(content)
-        
         else:
-            raise HTTPException(
-                status_code=400,
-                detail="Unsupported file type. Please upload PDF, DOCX, or TXT file."
-            )
+            text = await asyncio.to_thread(_extract_from_txt, file.file, budget)
+        
+        extraction_cache.put(cache_key, text)
+        EXTRACTION_SECONDS.observe(time.perf_counter() - started, file_type=extension, cache="miss")
+        return _truncate(text, max_chars)
     
     except HTTPException:
         raise
@@ -46,32 +117,250 @@ async def extract_text(file: UploadFile) -> str:
             status_code=500,
             detail=f"Error processing file: {str(e)}"
         )
+    finally:
+        if path is not None:
+            os.unlink(path)
+
+def _truncate(text: str, max_chars: int) -> Tuple[str, bool]:
+    if max_chars and len(text) > max_chars:
+        return text[:max_chars], True
+    return text, False
 
-def _extract_from_pdf(content: bytes) -> str:
-    """Extract text from PDF file"""
-    text = ""
-    pdf_document = fitz.open(stream=content, filetype="pdf")
+def _inspect_upload(upload: BinaryIO, extension: str) -> str:
+    """
+    Check the size and leading bytes of an upload and hash it (blocking)
+    
+    By the time a route runs, Starlette has already spooled the multipart
+    body (in memory up to 1MB, then to a temporary file), so this works on
+    that spooled file in place, one chunk at a time. Bodies far over the limit
+    never get here: the LimitUploadSize middleware rejects them from their
+    Content-Length or cuts them off while they arrive. This check covers the
+    file alone, without the multipart framing allowance.
     
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
-        text += page.get_text()
+    The hash is a second read of the spooled bytes rather than being computed
+    while they arrive, because the body is multipart: only the parser knows
+    where the file starts and ends.
     
-    pdf_document.close()
-    return text.strip()
+    Returns:
+        SHA-256 of the content
+    """
+    size = upload.seek(0, os.SEEK_END)
+    if size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Fayl juda katta. Maksimal hajm: {settings.MAX_FILE_SIZE // (1024 * 1024)}MB."
+        )
+    upload.seek(0)
+    digest = hashlib.sha256()
+    head = upload.read(UPLOAD_CHUNK_SIZE)
+    _check_magic_bytes(head, extension)
+    digest.update(head)
+    for chunk in iter(lambda: upload.read(UPLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    UPLOAD_SIZE.observe(size, file_type=extension)
+    return digest.hexdigest()
 
-def _extract_from_docx(content: bytes) -> str:
-    """Extract text from DOCX file"""
-    doc = Document(io.BytesIO(content))
-    text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-    return text.strip()
+def _copy_upload(upload: BinaryIO, extension: str) -> str:
+    """
+    Copy a spooled upload to a named temporary file (blocking)
+    
+    Worker processes open documents by path, and the spooled file has none.
+    
+    Returns:
+        Path of the temporary file; the caller deletes it
+    """
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp:
+        try:
+            shutil.copyfileobj(upload, tmp, UPLOAD_CHUNK_SIZE)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return tmp.name
 
-def _extract_from_txt(content: bytes) -> str:
+def parse_page_range(spec: str) -> List[Tuple[int, int]]:
+    """
+    Parse a 1-based, inclusive page selection like "3-4", "10" or "1-5,8,12-"
+    
+    Returns:
+        List of (first, last) page numbers; last is None for open-ended ranges
+        
+    Raises:
+        HTTPException: If the selection is malformed
+    """
+    ranges = []
+    for part in spec.replace("\u2013", "-").replace(" ", "").split(","):
+        match = re.fullmatch(r"(\d+)(?:-(\d*))?", part)
+        if not match:
+            raise HTTPException(status_code=400, detail=f"Noto'g'ri sahifa oralig'i: {spec}")
+        first = int(match.group(1))
+        if match.group(2) is None:
+            last = first
+        else:
+            last = int(match.group(2)) if match.group(2) else None
+        if first < 1 or (last is not None and last < first):
+            raise HTTPException(status_code=400, detail=f"Noto'g'ri sahifa oralig'i: {spec}")
+        ranges.append((first, last))
+    return ranges
+
+def _check_magic_bytes(head: bytes, extension: str):
+    expected = MAGIC_BYTES.get(extension)
+    if expected is not None:
+        valid = head.startswith(expected)
+    else:
+        # Plain text must not contain NUL bytes
+        valid = b"\x00" not in head
+    if not valid:
+        raise HTTPException(
+            status_code=400,
+            detail="Fayl mazmuni uning turiga mos emas. Iltimos, haqiqiy PDF, DOCX yoki TXT fayl yuklang."
+        )
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _worker_pids
+    if _pool is None:
+        _worker_pids = _mp_context.SimpleQueue()
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.EXTRACTION_WORKERS,
+            mp_context=_mp_context,
+            initializer=_announce_worker,
+            initargs=(_worker_pids,)
+        )
+    return _pool
+
+def _announce_worker(pids):
+    pids.put(os.getpid())
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Kill a pool whose worker is stuck or died; the next parse starts a fresh one"""
+    global _pool, _worker_pids
+    pids = None
+    if _pool is pool:
+        pids = _worker_pids
+        _pool = None
+        _worker_pids = None
+    # Executor has no public way to stop a running task, so terminate its workers
+    while pids is not None and not pids.empty():
+        try:
+            os.kill(pids.get(), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_extraction_pool():
+    global _pool, _worker_pids
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _worker_pids = None
+
+async def _run_parser(parser: Callable[..., str], path: str, *args) -> str:
+    """
+    Run a CPU-bound parser off the event loop
+    
+    At most EXTRACTION_MAX_CONCURRENT parses run at once, each limited to
+    EXTRACTION_TIMEOUT seconds. With EXTRACTION_WORKERS=0 parsers run in a
+    thread instead of a process pool.
+    
+    Raises:
+        HTTPException: 504 if the parse takes longer than EXTRACTION_TIMEOUT
+    """
+    global _parse_slots
+    if _parse_slots is None:
+        slots = settings.EXTRACTION_MAX_CONCURRENT
+        if settings.EXTRACTION_WORKERS > 0:
+            # A parse waiting for a free worker would spend its timeout in the executor's
+            # queue, and the timeout kills the pool with every parse running in it
+            slots = min(slots, settings.EXTRACTION_WORKERS)
+        _parse_slots = asyncio.Semaphore(max(slots, 1))
+    
+    async with _parse_slots:
+        if settings.EXTRACTION_WORKERS == 0:
+            try:
+                return await asyncio.wait_for(asyncio.to_thread(parser, path, *args), settings.EXTRACTION_TIMEOUT)
+            except asyncio.TimeoutError:
+                # The thread cannot be stopped; it finishes in the background
+                raise _extraction_timeout()
+        
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = _get_pool()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(pool, parser, path, *args),
+                    settings.EXTRACTION_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                _discard_pool(pool)
+                raise _extraction_timeout()
+            except BrokenProcessPool:
+                # Another parse timed out and took this pool down with it; retry once
+                _discard_pool(pool)
+                if attempt:
+                    raise
+
+def _extraction_timeout() -> HTTPException:
+    return HTTPException(
+        status_code=504,
+        detail="Faylni o'qish juda uzoq davom etdi. Iltimos, kichikroq fayl yuklang."
+    )
+
+def _extract_from_pdf(path: str, max_chars: int = 0, page_ranges: Optional[List[Tuple[int, Optional[int]]]] = None) -> str:
+    """Extract text from PDF file, stopping once max_chars are collected"""
+    pdf_document = fitz.open(path, filetype="pdf")
+    try:
+        if page_ranges:
+            page_numbers = []
+            for first, last in page_ranges:
+                last = pdf_document.page_count if last is None else min(last, pdf_document.page_count)
+                page_numbers.extend(range(first - 1, last))
+        else:
+            page_numbers = range(pdf_document.page_count)
+        
+        parts = []
+        size = 0
+        for page_num in page_numbers:
+            page_text = pdf_document[page_num].get_text()
+            parts.append(page_text)
+            size += len(page_text)
+            if max_chars and size >= max_chars:
+                break
+    finally:
+        pdf_document.close()
+    
+    return _limit("".join(parts), max_chars)
+
+def _extract_from_docx(path: str, max_chars: int = 0) -> str:
+    """Extract text from DOCX file, stopping once max_chars are collected"""
+    doc = Document(path)
+    parts = []
+    size = 0
+    for paragraph in doc.paragraphs:
+        parts.append(paragraph.text)
+        size += len(paragraph.text) + 1
+        if max_chars and size >= max_chars:
+            break
+    return _limit("\n".join(parts), max_chars)
+
+def _extract_from_txt(upload: BinaryIO, max_chars: int = 0) -> str:
     """Extract text from TXT file"""
+    upload.seek(0)
+    # UTF-8 needs at most 4 bytes per character
+    content = upload.read(max_chars * 4) if max_chars else upload.read()
     try:
         # Try UTF-8 first
         text = content.decode('utf-8')
-    except UnicodeDecodeError:
-        # Fallback to latin-1
-        text = content.decode('latin-1')
+    except UnicodeDecodeError as e:
+        if max_chars and e.start >= len(content) - 3:
+            # The read limit cut a multi-byte character in half
+            text = content[:e.start].decode('utf-8')
+        else:
+            # Fallback to latin-1
+            text = content.decode('latin-1')
     
-    return text.strip()
+    return _limit(text, max_chars)
+
+def _limit(text: str, max_chars: int) -> str:
+    text = text.strip()
+    return text[:max_chars] if max_chars else text
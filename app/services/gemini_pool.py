@@ -0,0 +1,228 @@
+"""
+Shared pool of Gemini API keys and models with rate budgets and health tracking
+"""
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import grpc
+from google.ai import generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+    GenerativeServiceGrpcAsyncIOTransport
+)
+
+from app.config import settings
+from app.utils.rate_limit import TokenBucket
+
+# How long a model that returned "not found" is skipped
+MODEL_MISSING_TTL = 3600
+# Cooldown after a 429 that does not say when to retry
+DEFAULT_RATE_LIMIT_COOLDOWN = 60.0
+# Weight of the newest call in a model's moving average latency
+LATENCY_SMOOTHING = 0.3
+
+
+class KeyState:
+    """Budget and health of one API key"""
+
+    def __init__(self, index: int, api_key: str, rpm: int):
+        self.index = index
+        self.api_key = api_key
+        self.bucket = TokenBucket(capacity=rpm, rate=rpm / 60.0)
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self.last_used = 0.0
+        self._client = None
+
+    @property
+    def label(self) -> str:
+        return f"Key #{self.index + 1}"
+
+    def client(self):
+        """Async client bound to this key, so calls never touch the global genai config"""
+        if self._client is None:
+            if settings.GEMINI_API_ENDPOINT:
+                # Local stand-in: plain gRPC, no credentials
+                transport = GenerativeServiceGrpcAsyncIOTransport(
+                    channel=grpc.aio.insecure_channel(settings.GEMINI_API_ENDPOINT)
+                )
+                self._client = glm.GenerativeServiceAsyncClient(transport=transport)
+            else:
+                self._client = glm.GenerativeServiceAsyncClient(
+                    client_options={"api_key": self.api_key}
+                )
+        return self._client
+
+    def wait_time(self, now: float) -> float:
+        return max(self.cooldown_until - now, self.bucket.wait_time(now), 0.0)
+
+
+class ModelState:
+    """Health of one model name (shared by all keys)"""
+
+    def __init__(self, name: str, priority: int):
+        self.name = name
+        self.priority = priority
+        self.missing_until = 0.0
+        self.consecutive_failures = 0
+        # Moving average of successful call durations (seconds), None until the first one
+        self.latency: Optional[float] = None
+
+
+class GeminiPool:
+    """
+    Hands out (key, model) pairs for Gemini calls.
+
+    Each key has its own client and a token bucket sized from its per-minute
+    quota. Keys that hit a 429 are put on cooldown for the delay the error
+    reports, models that returned "not found" are skipped, and the remaining
+    pairs are ranked by recent failures, model preference and least recent use
+    so load spreads across keys.
+    """
+
+    def __init__(self, api_keys: List[str], models: List[str], rpm_per_key: int):
+        self.keys = [KeyState(i, key, rpm_per_key) for i, key in enumerate(api_keys)]
+        self.models = [ModelState(name, i) for i, name in enumerate(models)]
+
+    def available_models(self) -> List[ModelState]:
+        now = time.monotonic()
+        return [m for m in self.models if m.missing_until <= now]
+
+    async def acquire(self, max_wait: float) -> Optional[Tuple[KeyState, ModelState]]:
+        """
+        Reserve the healthiest available key/model pair
+
+        Waits for the earliest key to free up if all are busy, but gives up
+        (returns None) when that would take longer than `max_wait` seconds or
+        when no usable model is left.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            models = self.available_models()
+            if not models or not self.keys:
+                return None
+
+            now = time.monotonic()
+            ready = [k for k in self.keys if k.wait_time(now) == 0]
+            if ready:
+                key = min(ready, key=lambda k: (k.consecutive_failures, k.last_used))
+                model = min(models, key=lambda m: (m.consecutive_failures, m.priority))
+                key.bucket.take(now)
+                key.last_used = now
+                return key, model
+
+            wait = min(k.wait_time(now) for k in self.keys)
+            if now + wait > deadline:
+                return None
+            print(f"DEBUG: All Gemini keys busy, waiting {wait:.1f}s for the next free one")
+            await asyncio.sleep(wait)
+
+    def content_request(
+        self, model: ModelState, prompt: str, generation_config: glm.GenerationConfig
+    ) -> glm.GenerateContentRequest:
+        """
+        Request for a single-turn prompt, to be sent with key.client()
+
+        The key's client is called directly instead of through
+        genai.GenerativeModel, which only takes the process-global
+        genai.configure(api_key=...).
+        """
+        name = model.name if "/" in model.name else f"models/{model.name}"
+        return glm.GenerateContentRequest(
+            model=name,
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            generation_config=generation_config
+        )
+
+    def typical_latency(self) -> float:
+        """
+        Expected duration of the next call in seconds: the fastest available
+        model's average, or 0 while no call has succeeded yet
+        """
+        latencies = [m.latency for m in self.available_models() if m.latency is not None]
+        return min(latencies) if latencies else 0.0
+
+    def report_success(self, key: KeyState, model: ModelState, duration: float):
+        key.consecutive_failures = 0
+        model.consecutive_failures = 0
+        if model.latency is None:
+            model.latency = duration
+        else:
+            model.latency += LATENCY_SMOOTHING * (duration - model.latency)
+
+    def report_rate_limit(self, key: KeyState, error: Exception):
+        delay = retry_delay_from_error(error)
+        key.cooldown_until = time.monotonic() + delay
+        key.bucket.tokens = min(key.bucket.tokens, 0)
+        print(f"DEBUG: {key.label} rate limited, cooling down for {delay:.0f}s")
+
+    def report_model_missing(self, model: ModelState):
+        model.missing_until = time.monotonic() + MODEL_MISSING_TTL
+        print(f"DEBUG: Model {model.name} not available, skipping it for {MODEL_MISSING_TTL}s")
+
+    def report_failure(self, key: KeyState, model: ModelState):
+        key.consecutive_failures += 1
+        model.consecutive_failures += 1
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "keys": [
+                {
+                    "key": k.label,
+                    "wait_seconds": round(k.wait_time(now), 1),
+                    "consecutive_failures": k.consecutive_failures
+                }
+                for k in self.keys
+            ],
+            "models": [
+                {
+                    "model": m.name,
+                    "available": m.missing_until <= now,
+                    "latency_seconds": round(m.latency, 2) if m.latency is not None else None,
+                    "consecutive_failures": m.consecutive_failures
+                }
+                for m in self.models
+            ]
+        }
+
+
+def is_rate_limit_error(message: str) -> bool:
+    message = message.lower()
+    return "429" in message or "quota" in message or "resource" in message
+
+
+def is_model_missing_error(message: str) -> bool:
+    message = message.lower()
+    return "404" in message or "not found" in message
+
+
+def retry_delay_from_error(error: Exception) -> float:
+    """Extract the retry delay Gemini reports with a 429, if any"""
+    message = str(error)
+    match = (
+        re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", message)
+        or re.search(r"retry in ([\d.]+)\s*s", message, re.IGNORECASE)
+    )
+    if match:
+        return float(match.group(1)) + 1
+    return DEFAULT_RATE_LIMIT_COOLDOWN
+
+
+def _models_to_try() -> List[str]:
+    # Models in order of preference for speed and rate limits
+    # gemini-1.5-flash is usually the fastest and most stable for free tier
+    models = ["gemini-1.5-flash", "gemini-1.5-flash-8b", "gemini-2.0-flash-exp", "gemini-1.5-pro"]
+    # If user has a specific model in settings, try it first
+    if settings.GEMINI_MODEL and settings.GEMINI_MODEL not in models:
+        models.insert(0, settings.GEMINI_MODEL)
+    return models
+
+
+# Global instance
+gemini_pool = GeminiPool(
+    settings.GEMINI_API_KEYS,
+    _models_to_try(),
+    rpm_per_key=settings.GEMINI_RPM_PER_KEY
+)
@@ -0,0 +1,49 @@
+"""
+Persistent, content-addressed cache of generated quizzes
+"""
+import hashlib
+import json
+import re
+from typing import Optional
+
+from app.config import settings
+from app.utils.disk_cache import DiskCache
+
+# Bump when the prompt changes so old generations are not served for it
+PROMPT_VERSION = "1"
+
+
+class GenerationCache(DiskCache):
+    """
+    Maps a hash of the normalized generation inputs (text, question count,
+    model, mode, prompt version) to the quiz JSON the model produced.
+    """
+
+    def __init__(self, db_path: str, ttl: int, max_bytes: int):
+        super().__init__(db_path, ttl, max_bytes, table="generations")
+
+    @staticmethod
+    def make_key(text: str, num_questions: int, model: str, mode: str = "single") -> str:
+        """Hash the generation inputs, ignoring whitespace and case differences"""
+        normalized = re.sub(r"\s+", " ", text).strip().lower()
+        digest = hashlib.sha256()
+        for part in (PROMPT_VERSION, model, mode, str(num_questions), normalized):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached quiz data for this key, or None on a miss"""
+        data = self.get_raw(key)
+        return json.loads(data) if data is not None else None
+
+    def put(self, key: str, quiz_data: dict) -> None:
+        self.put_raw(key, json.dumps(quiz_data, ensure_ascii=False))
+
+
+# Global instance
+generation_cache = GenerationCache(
+    settings.GENERATION_CACHE_DB_PATH,
+    ttl=settings.GENERATION_CACHE_TTL,
+    max_bytes=settings.GENERATION_CACHE_MAX_BYTES
+)
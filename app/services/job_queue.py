@@ -0,0 +1,326 @@
+"""
+Background queue for quiz generation jobs
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.models.quiz import TextInput
+from app.services.ai_service import generate_quiz
+from app.services.quiz_service import store_quiz_in_memory
+from app.services.quiz_store import quiz_store
+from app.services.similarity_index import similarity_index
+from app.utils.db import SQLiteDatabase
+
+# Workers look for jobs submitted to other processes this often (seconds)
+JOB_POLL_INTERVAL = 1.0
+# A running job is queued again if its process has not finished it this long after GENERATION_TIMEOUT
+JOB_LEASE_MARGIN = 60.0
+# How often finished and abandoned jobs are swept (seconds)
+PURGE_INTERVAL = 60
+
+
+class GenerationJob:
+    """State of one queued generation"""
+    __slots__ = (
+        "id", "status", "created_at", "started_at", "finished_at", "quiz_id", "error_status", "error"
+    )
+
+    def __init__(
+        self,
+        id: str,
+        status: str,
+        created_at: float,
+        started_at: Optional[float] = None,
+        finished_at: Optional[float] = None,
+        quiz_id: Optional[str] = None,
+        error_status: Optional[int] = None,
+        error: Optional[str] = None
+    ):
+        self.id = id
+        self.status = status  # queued -> running -> done | failed
+        self.created_at = created_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.quiz_id = quiz_id
+        self.error_status = error_status
+        self.error = error
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+        if self.quiz_id:
+            data["quiz_id"] = self.quiz_id
+        if self.error:
+            data["error"] = {"status": self.error_status, "detail": self.error}
+        return data
+
+
+class GenerationJobQueue:
+    """
+    Bounded queue of generation jobs processed by a fixed pool of workers.
+
+    Requests return a job ID immediately instead of holding the connection
+    open through Gemini retries. Once `max_backlog` jobs are waiting, new
+    jobs are rejected with 503 and a Retry-After estimate.
+
+    Jobs are rows in the SQLite database of the quiz store, so every uvicorn
+    worker can report any job, and queued jobs survive restarts. Each process
+    runs `workers` tasks that claim the oldest queued job with a conditional
+    UPDATE, so a job runs once no matter which process accepted it. A running
+    job whose process died is queued again once its lease runs out. Like the
+    Telegram state, this only coordinates processes that open the same
+    database file, i.e. workers on one host.
+    """
+
+    def __init__(self, db: SQLiteDatabase, workers: int, max_backlog: int, result_ttl: int):
+        self.db = db
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.result_ttl = result_ttl
+        # Identifies this process as the owner of the jobs it runs
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+        self._next_purge = 0.0
+        # Moving average of job duration, used for wait estimates
+        self._avg_duration = 15.0
+        self._init_db()
+
+    def _init_db(self):
+        conn = self.db.connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS generation_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " input TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " quiz_id TEXT,"
+            " error_status INTEGER,"
+            " error TEXT,"
+            " owner TEXT,"
+            " lease_until REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS generation_jobs_status ON generation_jobs (status, created_at)"
+        )
+
+    def start(self):
+        """Start the workers on the running event loop"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        """Queued jobs of all processes"""
+        return self.db.connection().execute(
+            "SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+
+    def estimated_wait(self, position: Optional[int] = None) -> float:
+        """Seconds until a job at `position` in the queue (default: a new job) finishes"""
+        if position is None:
+            position = self.depth
+        rounds = position // max(self.workers, 1) + 1
+        return round(rounds * self._avg_duration, 1)
+
+    def submit(self, input_data: TextInput) -> GenerationJob:
+        """
+        Enqueue a generation job
+
+        Raises:
+            HTTPException: 503 if the backlog limit is reached
+        """
+        self.start()
+        self._maybe_purge()
+
+        if self.depth >= self.max_backlog:
+            retry_after = int(self.estimated_wait()) + 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server band, iltimos birozdan so'ng qayta urinib ko'ring.",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+        job = GenerationJob(str(uuid.uuid4()), "queued", time.time())
+        self.db.connection().execute(
+            "INSERT INTO generation_jobs (job_id, status, input, created_at) VALUES (?, ?, ?, ?)",
+            (job.id, job.status, input_data.model_dump_json(), job.created_at)
+        )
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> GenerationJob:
+        row = self.db.connection().execute(
+            "SELECT job_id, status, created_at, started_at, finished_at, quiz_id, error_status, error"
+            " FROM generation_jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return GenerationJob(*row)
+
+    def position(self, job: GenerationJob) -> int:
+        """Number of queued jobs ahead of this one"""
+        if job.status != "queued":
+            return 0
+        return self.db.connection().execute(
+            "SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued' AND created_at < ?",
+            (job.created_at,)
+        ).fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queued": self.depth,
+            "max_backlog": self.max_backlog,
+            "estimated_wait": self.estimated_wait()
+        }
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + PURGE_INTERVAL
+        conn = self.db.connection()
+        conn.execute(
+            "DELETE FROM generation_jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+            (now - self.result_ttl,)
+        )
+        # The process running these died; let another worker take them
+        conn.execute(
+            "UPDATE generation_jobs SET status = 'queued', owner = NULL, started_at = NULL"
+            " WHERE status = 'running' AND lease_until < ?",
+            (now,)
+        )
+
+    def _claim(self) -> Optional[Tuple[str, TextInput]]:
+        """Take the oldest queued job, or return None if there is none"""
+        self._maybe_purge()
+        conn = self.db.connection()
+        while True:
+            row = conn.execute(
+                "SELECT job_id, input FROM generation_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            cursor = conn.execute(
+                "UPDATE generation_jobs SET status = 'running', owner = ?, started_at = ?, lease_until = ?"
+                " WHERE job_id = ? AND status = 'queued'",
+                (self.worker_id, now, now + settings.GENERATION_TIMEOUT + JOB_LEASE_MARGIN, row[0])
+            )
+            # Another worker took it first; try the next one
+            if cursor.rowcount == 1:
+                return row[0], TextInput.model_validate_json(row[1])
+
+    def _finish(self, job_id: str, quiz_id: Optional[str], error_status: Optional[int], error: Optional[str]):
+        # The source text is dropped, only the result is needed from now on
+        self.db.connection().execute(
+            "UPDATE generation_jobs SET status = ?, finished_at = ?, quiz_id = ?, error_status = ?, error = ?,"
+            " input = NULL, lease_until = NULL"
+            " WHERE job_id = ? AND owner = ?",
+            (
+                "done" if error is None else "failed", time.time(), quiz_id, error_status, error,
+                job_id, self.worker_id
+            )
+        )
+
+    def _requeue(self, job_id: str):
+        self.db.connection().execute(
+            "UPDATE generation_jobs SET status = 'queued', owner = NULL, started_at = NULL"
+            " WHERE job_id = ? AND owner = ? AND status = 'running'",
+            (job_id, self.worker_id)
+        )
+
+    async def _worker(self):
+        while True:
+            # Cleared before looking, so a job submitted meanwhile still wakes this worker
+            self._wakeup.clear()
+            try:
+                claimed = await asyncio.to_thread(self._claim)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error claiming generation job: {e}")
+                claimed = None
+            if claimed is None:
+                # Jobs submitted to other processes are only noticed by polling
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, data = claimed
+            self._running += 1
+            started_at = time.time()
+            quiz_id = error_status = error = None
+            try:
+                quiz = await generate_quiz(
+                    data.text,
+                    num_questions=data.num_questions,
+                    time_per_question=data.time_per_question,
+                    use_cache=not data.regenerate,
+                    full_document=data.full_document
+                )
+                quiz_id = store_quiz_in_memory(quiz)
+                # Only complete quizzes are offered to later requests for similar texts
+                if len(quiz.quiz) >= data.num_questions:
+                    await asyncio.to_thread(
+                        similarity_index.add,
+                        quiz_id,
+                        data.text,
+                        data.num_questions,
+                        "chunked" if data.full_document else "single"
+                    )
+            except asyncio.CancelledError:
+                # Shutting down: hand the job to another (or the next) process
+                self._requeue(job_id)
+                raise
+            except HTTPException as e:
+                error_status = e.status_code
+                error = str(e.detail)
+            except Exception as e:
+                print(f"Error generating quiz in job {job_id}: {e}")
+                error_status = 500
+                error = str(e)
+            finally:
+                self._running -= 1
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.time() - started_at)
+            try:
+                await asyncio.to_thread(self._finish, job_id, quiz_id, error_status, error)
+            except Exception as e:
+                print(f"Error saving result of job {job_id}: {e}")
+
+
+# Global instance
+job_queue = GenerationJobQueue(
+    quiz_store.db,
+    workers=settings.JOB_WORKERS,
+    max_backlog=settings.JOB_MAX_BACKLOG,
+    result_ttl=settings.JOB_RESULT_TTL
+)
@@ -0,0 +1,133 @@
+"""
+Tolerant parsing of quiz JSON produced by the model
+"""
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.models.quiz import Question
+from app.utils.json_stream import JSONArrayItemParser
+
+OPTION_LETTERS = "ABCD"
+# Fewer options than this cannot make a useful multiple-choice question
+MIN_OPTIONS = 2
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_LETTER = re.compile(r"^\(?([A-Da-d])[).:]?$")
+
+
+def parse_quiz_output(content: str) -> Tuple[List[Question], int]:
+    """
+    Recover every usable question from a model response
+
+    Handles markdown fences, trailing commas, a bare array instead of
+    {"quiz": [...]}, and output cut off mid-question (only the complete
+    questions are kept). Each item is checked and repaired where possible by
+    normalize_question().
+
+    Returns:
+        (questions, number of items that had to be dropped)
+    """
+    items = _load_items(_strip_fences(content))
+    questions = []
+    for item in items:
+        question = normalize_question(item)
+        if question is not None:
+            questions.append(question)
+    return questions, len(items) - len(questions)
+
+
+def _strip_fences(content: str) -> str:
+    return content.replace("```json", "").replace("```", "").strip()
+
+
+def _load_items(content: str) -> List[Any]:
+    for candidate in (content, _TRAILING_COMMA.sub(r"\1", content)):
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            data = data.get("quiz")
+        if isinstance(data, list):
+            return data
+
+    # Truncated or otherwise broken document: salvage the complete items
+    if content.startswith("["):
+        content = '{"quiz":' + content
+    parser = JSONArrayItemParser("quiz")
+    return parser.feed(_TRAILING_COMMA.sub(r"\1", content))
+
+
+def normalize_question(item: Any) -> Optional[Question]:
+    """
+    Validate one question, repairing what can be repaired
+
+    Option labels like "a)" or a plain list of options are mapped to A-D,
+    options with no text are removed and the remaining ones relabelled in
+    order. The correct answer must point at exactly one remaining option
+    (given as its letter or its text). Returns None if the item is unusable.
+    """
+    if not isinstance(item, dict):
+        return None
+    text = item.get("question")
+    if not isinstance(text, str) or not text.strip():
+        return None
+
+    options = _normalize_options(item.get("options"))
+    if options is None or len(options) < MIN_OPTIONS:
+        return None
+
+    correct = _correct_letter(item.get("correct_answer"), options)
+    if correct is None:
+        return None
+
+    # Relabel so letters stay contiguous after removing empty options
+    letters = list(options)
+    relabelled = {OPTION_LETTERS[i]: options[letter] for i, letter in enumerate(letters)}
+    try:
+        return Question(
+            question=text.strip(),
+            options=relabelled,
+            correct_answer=OPTION_LETTERS[letters.index(correct)]
+        )
+    except ValidationError:
+        return None
+
+
+def _normalize_options(raw: Any) -> Optional[dict]:
+    if isinstance(raw, list):
+        raw = {OPTION_LETTERS[i]: value for i, value in enumerate(raw[:len(OPTION_LETTERS)])}
+    if not isinstance(raw, dict):
+        return None
+
+    options = {}
+    for label, value in raw.items():
+        letter = _letter(label)
+        if letter is None or letter in options:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if isinstance(value, str) and value.strip():
+            options[letter] = value.strip()
+    return {letter: options[letter] for letter in OPTION_LETTERS if letter in options}
+
+
+def _correct_letter(raw: Any, options: dict) -> Optional[str]:
+    if not isinstance(raw, str):
+        return None
+    letter = _letter(raw)
+    if letter is None:
+        # Some responses repeat the option text instead of its letter
+        matches = [key for key, value in options.items() if value.lower() == raw.strip().lower()]
+        letter = matches[0] if len(matches) == 1 else None
+    return letter if letter in options else None
+
+
+def _letter(label: Any) -> Optional[str]:
+    if not isinstance(label, str):
+        return None
+    match = _LETTER.match(label.strip())
+    return match.group(1).upper() if match else None
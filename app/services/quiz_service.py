@@ -16,14 +16,26 @@ def evaluate_answers(quiz: Quiz, submission: AnswerSubmission) -> QuizResult:
         HTTPException: If submission is invalid
     """
     
-    total = len(quiz.quiz)
-    score = 0
+    return evaluate_with_answer_key(build_answer_key(quiz), submission)
+
+def evaluate_with_answer_key(answer_key: str, submission: AnswerSubmission) -> QuizResult:
+    """
+    Evaluate user's answers against a precompiled answer key
     
-    # Check each answer
-    for idx, question in enumerate(quiz.quiz):
-        user_answer = submission.answers.get(idx)
+    Args:
+        answer_key: Correct letters of the quiz, one per question
+        submission: User's submitted answers
         
-        if user_answer and user_answer == question.correct_answer:
+    Returns:
+        QuizResult with score, total, and percentage
+    """
+    
+    total = len(answer_key)
+    score = 0
+    
+    # Only the submitted answers are visited
+    for idx, user_answer in submission.answers.items():
+        if 0 <= idx < total and user_answer == answer_key[idx]:
             score += 1
     
     # Calculate percentage
@@ -35,49 +47,46 @@ def evaluate_answers(quiz: Quiz, submission: AnswerSubmission) -> QuizResult:
         percentage=percentage
     )
 
-import json
-import os
 import uuid
-
-# Storage path
-STORAGE_FILE = "quizzes.json"
-
-def _load_storage():
-    """Load storage from file"""
-    if not os.path.exists(STORAGE_FILE):
-        return {}
-    try:
-        with open(STORAGE_FILE, "r") as f:
-            return json.load(f)
-    except:
-        return {}
-
-def _save_storage(data):
-    """Save storage to file"""
-    try:
-        with open(STORAGE_FILE, "w") as f:
-            json.dump(data, f)
-    except:
-        pass
+from app.services.quiz_store import quiz_store, build_answer_key, QuizPayload
 
 def store_quiz_in_memory(quiz: Quiz) -> str:
     """
-    Store quiz in a file to survive reloads
+    Store quiz in the persistent quiz store to survive reloads
     """
     quiz_id = str(uuid.uuid4())
-    storage = _load_storage()
-    storage[quiz_id] = quiz.dict()
-    _save_storage(storage)
+    quiz_store.put(quiz_id, quiz)
     return quiz_id
 
 def get_quiz_from_memory(quiz_id: str) -> Quiz:
     """
-    Retrieve quiz from file by ID
+    Retrieve quiz by ID (served from the in-memory cache when hot)
+    """
+    quiz = quiz_store.get(quiz_id)
+    
+    if quiz is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    
+    return quiz
+
+def get_answer_key(quiz_id: str) -> str:
+    """
+    Retrieve the precompiled answer key of a quiz by ID
+    """
+    answer_key = quiz_store.get_answer_key(quiz_id)
+    
+    if answer_key is None:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+    
+    return answer_key
+
+def get_quiz_payload(quiz_id: str, include_answers: bool = True) -> QuizPayload:
+    """
+    Retrieve the pre-serialized JSON body of a quiz by ID
     """
-    storage = _load_storage()
-    quiz_data = storage.get(quiz_id)
+    payload = quiz_store.get_payload(quiz_id, include_answers)
     
-    if not quiz_data:
+    if payload is None:
         raise HTTPException(status_code=404, detail="Quiz not found")
     
-    return Quiz(**quiz_data)
+    return payload
@@ -0,0 +1,219 @@
+"""
+Indexed quiz storage backed by SQLite (WAL mode)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from app.config import settings
+from app.models.quiz import Quiz
+from app.utils.cache import LRUCache
+from app.utils.db import SQLiteDatabase
+from app.utils.metrics import Counter, Histogram
+
+STORE_SECONDS = Histogram(
+    "testify_quiz_store_duration_seconds", "Quiz store writes and reads that reach SQLite", ["op"]
+)
+STORE_CACHE = Counter(
+    "testify_quiz_store_cache_total", "Quiz store lookups answered from memory or not", ["op", "result"]
+)
+
+# Stands in for a correct answer that is not a single letter; never matches a submission
+NO_KEY = "\0"
+
+
+class QuizPayload:
+    """Ready-to-send JSON body of a quiz and its strong ETag"""
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def build_payload(quiz_id: str, quiz_json: str) -> QuizPayload:
+    """Wrap already serialized quiz JSON as {"quiz_id": ..., "quiz": {...}} without re-encoding it"""
+    return QuizPayload(
+        ('{"quiz_id":' + json.dumps(quiz_id) + ',"quiz":' + quiz_json + '}').encode("utf-8")
+    )
+
+
+def player_quiz_json(quiz: Quiz) -> str:
+    """The quiz without correct answers, for players"""
+    return quiz.model_dump_json(exclude={"quiz": {"__all__": {"correct_answer"}}})
+
+
+def build_answer_key(quiz: Quiz) -> str:
+    """Correct letters of a quiz as one string, e.g. "ACBD" (its length is the question count)"""
+    return "".join(
+        q.correct_answer if len(q.correct_answer) == 1 else NO_KEY
+        for q in quiz.quiz
+    )
+
+
+class QuizStore:
+    """
+    Stores quizzes by ID in an embedded SQLite database.
+
+    Reads and writes are single-row primary key lookups, so they cost the same
+    no matter how many quizzes are stored. Validated Quiz objects are kept in an
+    LRU cache so hot lookups skip both disk I/O and pydantic validation.
+
+    Each quiz's answer key (its correct letters as a string) is stored in its
+    own column when the quiz is saved and cached separately, so scoring a
+    submission never has to load or validate the question texts. The JSON
+    bodies served by GET /api/quiz/{id} (with and without answers) are also
+    serialized once and cached, so repeated reads only copy bytes.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        cache_size: int = 1024,
+        key_cache_size: int = 100000,
+        legacy_file: Optional[str] = None
+    ):
+        self.db = SQLiteDatabase(db_path)
+        self.cache = LRUCache(cache_size)
+        self.answer_keys = LRUCache(key_cache_size)
+        # (quiz_id, include_answers) -> QuizPayload
+        self.payloads = LRUCache(cache_size)
+        self._init_db()
+        if legacy_file:
+            self._import_legacy_file(legacy_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        return self.db.connection()
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quizzes ("
+            " quiz_id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " answer_key TEXT)"
+        )
+        # Databases created before answer keys were stored; old rows are filled in on first use
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(quizzes)")]
+        if "answer_key" not in columns:
+            conn.execute("ALTER TABLE quizzes ADD COLUMN answer_key TEXT")
+
+    def _import_legacy_file(self, path: str):
+        """One-time import of the old whole-file quizzes.json store"""
+        if not os.path.exists(path):
+            return
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM quizzes LIMIT 1").fetchone():
+            return
+        try:
+            with open(path, "r") as f:
+                legacy = json.load(f)
+        except Exception:
+            return
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR IGNORE INTO quizzes (quiz_id, data, created_at) VALUES (?, ?, ?)",
+                [(quiz_id, json.dumps(data), now) for quiz_id, data in legacy.items()]
+            )
+
+    def put(self, quiz_id: str, quiz: Quiz) -> None:
+        """Insert or replace a quiz"""
+        with STORE_SECONDS.time(op="put"):
+            answer_key = build_answer_key(quiz)
+            data = quiz.model_dump_json()
+            self._connect().execute(
+                "INSERT OR REPLACE INTO quizzes (quiz_id, data, created_at, answer_key) VALUES (?, ?, ?, ?)",
+                (quiz_id, data, time.time(), answer_key)
+            )
+            self.cache.put(quiz_id, quiz)
+            self.answer_keys.put(quiz_id, answer_key)
+            self.payloads.put((quiz_id, True), build_payload(quiz_id, data))
+            self.payloads.put((quiz_id, False), build_payload(quiz_id, player_quiz_json(quiz)))
+
+    def get_payload(self, quiz_id: str, include_answers: bool = True) -> Optional[QuizPayload]:
+        """Return the serialized quiz for this ID, or None if it does not exist"""
+        payload = self.payloads.get((quiz_id, include_answers))
+        if payload is not None:
+            STORE_CACHE.inc(op="get_payload", result="hit")
+            return payload
+
+        STORE_CACHE.inc(op="get_payload", result="miss")
+        with STORE_SECONDS.time(op="get_payload"):
+            payload = self._load_payload(quiz_id, include_answers)
+        if payload is not None:
+            self.payloads.put((quiz_id, include_answers), payload)
+        return payload
+
+    def _load_payload(self, quiz_id: str, include_answers: bool) -> Optional[QuizPayload]:
+        if include_answers:
+            # The stored column already holds the serialized quiz
+            row = self._connect().execute(
+                "SELECT data FROM quizzes WHERE quiz_id = ?", (quiz_id,)
+            ).fetchone()
+            return build_payload(quiz_id, row[0]) if row is not None else None
+
+        quiz = self.get(quiz_id)
+        return build_payload(quiz_id, player_quiz_json(quiz)) if quiz is not None else None
+
+    def get_answer_key(self, quiz_id: str) -> Optional[str]:
+        """Return the answer key for this ID, or None if the quiz does not exist"""
+        answer_key = self.answer_keys.get(quiz_id)
+        if answer_key is not None:
+            STORE_CACHE.inc(op="get_answer_key", result="hit")
+            return answer_key
+
+        STORE_CACHE.inc(op="get_answer_key", result="miss")
+        with STORE_SECONDS.time(op="get_answer_key"):
+            answer_key = self._load_answer_key(quiz_id)
+        if answer_key is not None:
+            self.answer_keys.put(quiz_id, answer_key)
+        return answer_key
+
+    def _load_answer_key(self, quiz_id: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT answer_key FROM quizzes WHERE quiz_id = ?", (quiz_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        answer_key = row[0]
+        if answer_key is None:
+            quiz = self.get(quiz_id)
+            answer_key = build_answer_key(quiz)
+            self._connect().execute(
+                "UPDATE quizzes SET answer_key = ? WHERE quiz_id = ?", (answer_key, quiz_id)
+            )
+        return answer_key
+
+    def get(self, quiz_id: str) -> Optional[Quiz]:
+        """Return the quiz for this ID, or None if it does not exist"""
+        quiz = self.cache.get(quiz_id)
+        if quiz is not None:
+            STORE_CACHE.inc(op="get", result="hit")
+            return quiz
+
+        STORE_CACHE.inc(op="get", result="miss")
+        with STORE_SECONDS.time(op="get"):
+            row = self._connect().execute(
+                "SELECT data FROM quizzes WHERE quiz_id = ?", (quiz_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            quiz = Quiz.model_validate_json(row[0])
+        self.cache.put(quiz_id, quiz)
+        return quiz
+
+
+# Global instance
+quiz_store = QuizStore(
+    settings.QUIZ_DB_PATH,
+    cache_size=settings.QUIZ_CACHE_SIZE,
+    key_cache_size=settings.QUIZ_KEY_CACHE_SIZE,
+    legacy_file="quizzes.json"
+)
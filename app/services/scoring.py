@@ -0,0 +1,118 @@
+"""
+Vectorized scoring of many submissions to one quiz
+"""
+from typing import List
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.config import settings
+from app.models.quiz import Quiz, StudentSubmission, BatchResult, StudentResult, QuestionStats
+
+# Response codes: 0 = no answer, 1 = answer that is not a single letter, else ord(letter)
+UNANSWERED = 0
+INVALID = 1
+# Share of students in each of the upper and lower groups of the discrimination index
+DISCRIMINATION_GROUP = 0.27
+
+
+def compile_answer_key(answer_key: str) -> np.ndarray:
+    """
+    A stored answer key string (see quiz_store.build_answer_key) as a uint8
+    array of character codes; its NO_KEY placeholders become UNANSWERED
+    """
+    return np.array([_code(letter) for letter in answer_key], dtype=np.uint8)
+
+
+def _code(answer: str) -> int:
+    if not answer:
+        return UNANSWERED
+    if len(answer) != 1 or ord(answer) > 255:
+        return INVALID
+    return ord(answer)
+
+
+def _response_matrix(submissions: List[StudentSubmission], total: int) -> np.ndarray:
+    responses = np.zeros((len(submissions), total), dtype=np.uint8)
+    for row, submission in enumerate(submissions):
+        for idx, answer in submission.answers.items():
+            if 0 <= idx < total:
+                responses[row, idx] = _code(answer)
+    return responses
+
+
+def score_submissions(quiz: Quiz, answer_key: str, submissions: List[StudentSubmission]) -> BatchResult:
+    """
+    Score all submissions in one pass and compute per-question statistics
+
+    The quiz's cached answer key is compiled once and compared against a
+    students x questions matrix, so the cost per student is a row of byte
+    comparisons. The quiz itself only supplies the options and correct
+    answers reported in the per-question statistics.
+
+    Raises:
+        HTTPException: 400 if the batch is larger than BATCH_SCORING_MAX_SUBMISSIONS
+    """
+    if len(submissions) > settings.BATCH_SCORING_MAX_SUBMISSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Bir so'rovda ko'pi bilan {settings.BATCH_SCORING_MAX_SUBMISSIONS} ta javob yuborish mumkin."
+        )
+
+    total = len(answer_key)
+    key = compile_answer_key(answer_key)
+    responses = _response_matrix(submissions, total)
+    # A question with no valid key (should not happen) is never counted as correct
+    correct = (responses == key) & (key > INVALID)
+    scores = correct.sum(axis=1)
+    percentages = np.round(scores / total * 100, 2) if total else np.zeros(len(submissions))
+
+    results = [
+        StudentResult(
+            student_id=submission.student_id,
+            score=int(score),
+            total=total,
+            percentage=float(percentage)
+        )
+        for submission, score, percentage in zip(submissions, scores, percentages)
+    ]
+
+    correct_rates = correct.mean(axis=0) if submissions else np.zeros(total)
+    unanswered = (responses == UNANSWERED).sum(axis=0)
+    discrimination = _discrimination_index(correct, scores)
+    letters = sorted({letter for q in quiz.quiz for letter in q.options})
+    counts = {letter: (responses == _code(letter)).sum(axis=0) for letter in letters}
+
+    questions = [
+        QuestionStats(
+            index=i,
+            correct_answer=q.correct_answer,
+            correct_rate=round(float(correct_rates[i]), 4),
+            option_distribution={letter: int(counts[letter][i]) for letter in q.options},
+            unanswered=int(unanswered[i]),
+            discrimination_index=None if discrimination is None else round(float(discrimination[i]), 4)
+        )
+        for i, q in enumerate(quiz.quiz)
+    ]
+
+    return BatchResult(
+        total=total,
+        mean_percentage=round(float(percentages.mean()), 2) if submissions else 0,
+        results=results,
+        questions=questions
+    )
+
+
+def _discrimination_index(correct: np.ndarray, scores: np.ndarray):
+    """
+    Correct rate of the top-scoring students minus that of the bottom-scoring
+    ones, per question (None when there are too few students to split)
+    """
+    n = len(scores)
+    if n < 2:
+        return None
+    group = max(1, int(round(n * DISCRIMINATION_GROUP)))
+    order = np.argsort(scores, kind="stable")
+    lower = correct[order[:group]].mean(axis=0)
+    upper = correct[order[-group:]].mean(axis=0)
+    return upper - lower
@@ -0,0 +1,161 @@
+"""
+Near-duplicate lookup of source texts of stored quizzes (MinHash + LSH)
+"""
+import hashlib
+import re
+import sqlite3
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.quiz_store import quiz_store
+from app.utils.db import SQLiteDatabase
+
+# Words per shingle
+SHINGLE_SIZE = 3
+# Signature length and its split into LSH bands (bands * rows == NUM_PERM).
+# 16 bands of 8 rows make pairs above ~0.7 Jaccard similarity likely candidates.
+NUM_PERM = 128
+BANDS = 16
+# Largest prime below 2**32; every hash value and coefficient stays below it,
+# so a * x + b fits in uint64 without overflow
+_PRIME = np.uint64(4294967291)
+# Fixed seed: signatures are persisted, so the permutations must never change
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """
+    MinHash signature of the word shingles of a text
+
+    Case, punctuation and whitespace are ignored, so the same document
+    exported by another tool usually gets a near-identical signature.
+    Returns None when the text has too few words to compare.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return None
+    shingles = {
+        " ".join(words[i:i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    ) % _PRIME
+    # One row per permutation; the minimum over all shingles is the signature value
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def _band_buckets(signature: np.ndarray):
+    rows = NUM_PERM // BANDS
+    for band in range(BANDS):
+        digest = hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest()
+        yield band, int.from_bytes(digest, "big", signed=True)
+
+
+class SimilarityIndex:
+    """
+    Finds stored quizzes generated from nearly the same text.
+
+    Lives in the quiz database next to the quizzes it points to. Each indexed
+    text gets a MinHash signature; its bands are stored in an indexed bucket
+    table so a lookup is BANDS primary-key probes plus a comparison with the
+    few candidates that share a bucket, no matter how many quizzes exist.
+    """
+
+    def __init__(self, db: SQLiteDatabase, threshold: float):
+        self.db = db
+        self.threshold = threshold
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self.db.connection()
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quiz_signatures ("
+            " quiz_id TEXT PRIMARY KEY,"
+            " signature BLOB NOT NULL,"
+            " num_questions INTEGER NOT NULL,"
+            " mode TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quiz_lsh ("
+            " band INTEGER NOT NULL,"
+            " bucket INTEGER NOT NULL,"
+            " quiz_id TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS quiz_lsh_bucket ON quiz_lsh (band, bucket)")
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def add(self, quiz_id: str, text: str, num_questions: int, mode: str = "single") -> None:
+        """Index the source text of a newly generated quiz"""
+        if not self.enabled:
+            return
+        signature = minhash_signature(text)
+        if signature is None:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT OR REPLACE INTO quiz_signatures (quiz_id, signature, num_questions, mode) VALUES (?, ?, ?, ?)",
+                (quiz_id, signature.tobytes(), num_questions, mode)
+            )
+            conn.executemany(
+                "INSERT INTO quiz_lsh (band, bucket, quiz_id) VALUES (?, ?, ?)",
+                [(band, bucket, quiz_id) for band, bucket in _band_buckets(signature)]
+            )
+
+    def find(self, text: str, num_questions: int, mode: str = "single") -> Optional[Tuple[str, float]]:
+        """
+        Return (quiz_id, estimated similarity) of the closest stored quiz made
+        with the same settings, if it is at least `threshold` similar
+        """
+        if not self.enabled:
+            return None
+        signature = minhash_signature(text)
+        if signature is None:
+            return None
+
+        conn = self._connect()
+        candidates = set()
+        for band, bucket in _band_buckets(signature):
+            candidates.update(
+                row[0] for row in conn.execute(
+                    "SELECT quiz_id FROM quiz_lsh WHERE band = ? AND bucket = ?", (band, bucket)
+                )
+            )
+        if not candidates:
+            return None
+
+        placeholders = ",".join("?" * len(candidates))
+        rows = conn.execute(
+            f"SELECT quiz_id, signature FROM quiz_signatures"
+            f" WHERE quiz_id IN ({placeholders}) AND num_questions = ? AND mode = ?",
+            (*candidates, num_questions, mode)
+        ).fetchall()
+
+        best = None
+        for quiz_id, blob in rows:
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (quiz_id, similarity)
+        return best
+
+
+# Global instance
+similarity_index = SimilarityIndex(quiz_store.db, threshold=settings.SIMILARITY_THRESHOLD)
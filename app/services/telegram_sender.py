@@ -0,0 +1,168 @@
+"""
+Outgoing Telegram message scheduler with flood control
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram.error import RetryAfter
+
+from app.config import settings
+from app.utils.metrics import Counter, Gauge, Histogram
+from app.utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_HIGH = 0    # quiz polls and leaderboards
+PRIORITY_NORMAL = 1  # direct replies to commands
+PRIORITY_LOW = 2     # chatter (pings, hints)
+
+# Give up on a message after this many RetryAfter responses
+MAX_RETRIES = 3
+
+SEND_SECONDS = Histogram(
+    "testify_telegram_send_duration_seconds",
+    "Outgoing Telegram messages: time waiting in the send queue and in the API call",
+    ["stage"]
+)
+RETRY_AFTER = Counter("testify_telegram_retry_after_total", "Flood-control (RetryAfter) responses from Telegram")
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "send", "future", "retries", "queued_at")
+
+    def __init__(self, chat_id: int, send: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.send = send
+        self.future = future
+        self.retries = 0
+        self.queued_at = time.monotonic()
+
+
+class MessageScheduler:
+    """
+    Sends bot API calls through one priority queue.
+
+    A global token bucket keeps the bot under Telegram's overall limit, and
+    each chat is paced separately (groups allow far fewer messages per minute
+    than private chats). RetryAfter responses pause only the affected chat
+    and the message is queued again, so a flood-control error never aborts a
+    quiz. Higher-priority messages (polls, leaderboards) overtake chatter.
+    """
+
+    def __init__(self, global_rate: float, private_interval: float, group_interval: float):
+        self.bucket = TokenBucket(capacity=global_rate, rate=global_rate)
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._chat_ready: Dict[int, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def send(self, chat_id: int, send: Callable[[], Awaitable[Any]], priority: int = PRIORITY_NORMAL) -> Any:
+        """
+        Queue a bot API call for a chat and wait for its result
+
+        Args:
+            chat_id: Target chat, used for per-chat pacing
+            send: Zero-argument callable returning the API call coroutine
+                (called again if Telegram asks to retry)
+            priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+        """
+        self._ensure_started()
+        item = _Outgoing(chat_id, send, asyncio.get_running_loop().create_future())
+        self._push(priority, next(self._seq), item)
+        return await item.future
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def _ensure_started(self):
+        # Bound to the loop the bot runs on (polling thread or FastAPI loop)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _push(self, priority: int, seq: int, item: _Outgoing):
+        heapq.heappush(self._heap, (priority, seq, item))
+        self._wakeup.set()
+
+    def _interval(self, chat_id: int) -> float:
+        # Group and channel IDs are negative
+        return self.group_interval if chat_id < 0 else self.private_interval
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, seq, item = heapq.heappop(self._heap)
+            now = time.monotonic()
+            ready_at = self._chat_ready.get(item.chat_id, 0.0)
+            if ready_at > now:
+                # Chat is still paced; requeue with its original position when it frees up
+                loop.call_later(ready_at - now, self._push, priority, seq, item)
+                continue
+
+            wait = self.bucket.wait_time(now)
+            if wait > 0:
+                heapq.heappush(self._heap, (priority, seq, item))
+                await asyncio.sleep(wait)
+                continue
+
+            self.bucket.take(now)
+            self._chat_ready[item.chat_id] = now + self._interval(item.chat_id)
+            SEND_SECONDS.observe(now - item.queued_at, stage="queue")
+            loop.create_task(self._deliver(priority, seq, item))
+            self._forget_idle_chats(now)
+
+    async def _deliver(self, priority: int, seq: int, item: _Outgoing):
+        started = time.monotonic()
+        try:
+            result = await item.send()
+        except RetryAfter as e:
+            RETRY_AFTER.inc()
+            delay = e.retry_after
+            delay = delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+            self._chat_ready[item.chat_id] = time.monotonic() + delay
+            item.retries += 1
+            if item.retries > MAX_RETRIES:
+                if not item.future.done():
+                    item.future.set_exception(e)
+                return
+            logger.warning(f"Flood control in chat {item.chat_id}, retrying in {delay:.0f}s")
+            item.queued_at = time.monotonic()
+            self._push(priority, seq, item)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            SEND_SECONDS.observe(time.monotonic() - started, stage="api")
+            if not item.future.done():
+                item.future.set_result(result)
+
+    def _forget_idle_chats(self, now: float):
+        # Keep the pacing table small: chats whose pause has passed need no entry
+        if len(self._chat_ready) > 10000:
+            self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+
+
+# Global instance
+message_scheduler = MessageScheduler(
+    global_rate=settings.TELEGRAM_GLOBAL_RATE,
+    private_interval=settings.TELEGRAM_PRIVATE_INTERVAL,
+    group_interval=settings.TELEGRAM_GROUP_INTERVAL
+)
+
+PENDING_MESSAGES = Gauge(
+    "testify_telegram_pending_messages", "Messages waiting in the Telegram send queue",
+    function=message_scheduler.pending
+)
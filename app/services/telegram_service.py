@@ -1,11 +1,21 @@
 import os
+import time
+import uuid
+import socket
 import asyncio
+import hashlib
+import hmac
 import logging
 import threading
+from typing import Optional
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, Poll, ReplyKeyboardMarkup, WebAppInfo, PollAnswer
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters, PollAnswerHandler
 from app.services.quiz_service import get_quiz_from_memory
+from app.services.quiz_store import quiz_store
+from app.services.telegram_state import QuizBotState, QuizSession
+from app.services.telegram_sender import message_scheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from app.config import settings
+from app.utils.metrics import Gauge
 
 # Configure logging
 logging.basicConfig(
@@ -13,32 +23,35 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# The quiz scheduler runs every second; keep its job runs out of the INFO log
+logging.getLogger("apscheduler").setLevel(logging.WARNING)
 
-# Additional storage for user sessions
-USER_SESSIONS_FILE = "user_sessions.json"
-
-def _load_sessions():
-    if not os.path.exists(USER_SESSIONS_FILE): return {}
-    try:
-        with open(USER_SESSIONS_FILE, "r") as f: return json.load(f)
-    except: return {}
+# How often the scheduling owner looks for quiz steps that are due (seconds)
+SCHEDULER_TICK = 1.0
+# Another worker takes over scheduling once the owner has not renewed its lease for this long
+SCHEDULER_LEASE_TTL = 10.0
+SCHEDULER_LEASE = "quiz_scheduler"
+# A claimed step whose poll has not been sent within this long no longer holds up the next one
+STEP_SEND_TIMEOUT = 120.0
 
-def _save_session(user_id, quiz_id):
-    try:
-        sessions = _load_sessions()
-        sessions[str(user_id)] = quiz_id
-        with open(USER_SESSIONS_FILE, "w") as f: json.dump(sessions, f)
-    except: pass
+# Former per-process store of each user's last quiz, imported into the database once
+USER_SESSIONS_FILE = "user_sessions.json"
 
 class TelegramQuizBot:
     def __init__(self):
         self.token = settings.TELEGRAM_BOT_TOKEN
         self.app_url = settings.WEB_APP_URL
         self.application = None
-        # Track active polls: { poll_id: { "correct_index": int, "chat_id": int, "quiz_id": str } }
-        self.active_polls = {}
-        # Track results: { (chat_id, quiz_id): { user_id: { "name": str, "score": int, "answers": int } } }
-        self.quiz_results = {}
+        # Active polls, scores per (chat_id, quiz_id) and running quiz sessions, shared by all workers
+        self.state = QuizBotState(
+            quiz_store.db,
+            result_ttl=settings.TELEGRAM_RESULT_TTL,
+            legacy_sessions_file=USER_SESSIONS_FILE
+        )
+        # Identifies this process when it holds the scheduler lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Every outgoing message goes through the flood-control scheduler
+        self.sender = message_scheduler
 
     async def set_menu_button(self):
         """Set the main bot menu button to open the Web App"""
@@ -67,15 +80,14 @@ class TelegramQuizBot:
                 payload = args[0]
                 if payload.startswith("q_"):
                     quiz_id = payload[2:]
-                    _save_session(user_id, quiz_id)
                 elif payload.startswith("startgroup_q_"):
                     quiz_id = payload[13:]
-                    _save_session(user_id, quiz_id)
+                if quiz_id:
+                    await asyncio.to_thread(self.state.set_last_quiz, user_id, quiz_id)
 
             # 2. If no args, try to fetch last session
             if not quiz_id:
-                sessions = _load_sessions()
-                quiz_id = sessions.get(str(user_id))
+                quiz_id = await asyncio.to_thread(self.state.get_last_quiz, user_id)
                 logger.debug(f"Fetched session quiz_id for {user_id}: {quiz_id}")
 
             if quiz_id:
@@ -83,7 +95,8 @@ class TelegramQuizBot:
                     quiz = get_quiz_from_memory(quiz_id)
                     title = getattr(quiz, 'title', 'Yangi Quiz')
                     
-                    await update.message.reply_text(
+                    await self._reply(
+                        update,
                         f"✅ **{title}** topildi!\n"
                         f"Bu quiz {len(quiz.quiz)} ta savoldan iborat.\n\n"
                         "Savollarni birma-bir yuboryapman... 👇",
@@ -92,63 +105,13 @@ class TelegramQuizBot:
 
                     duration = getattr(quiz, 'time_per_question', 30)
                     
-                    # Initialize results for this session
-                    session_key = (chat_id, quiz_id)
-                    self.quiz_results[session_key] = {}
-                    
-                    for i, q in enumerate(quiz.quiz):
-                        options = [opt for opt in q.options.values()]
-                        opt_keys = list(q.options.keys())
-                        try:
-                            correct_index = opt_keys.index(q.correct_answer)
-                        except ValueError:
-                            correct_index = 0
-                        
-                        message = await context.bot.send_poll(
-                            chat_id=chat_id,
-                            question=f"{i+1}. {q.question}",
-                            options=options,
-                            type=Poll.QUIZ,
-                            correct_option_id=correct_index,
-                            is_anonymous=False,
-                            open_period=duration,
-                            explanation="To'g'ri javobni tanlang."
-                        )
-                        
-                        # Register poll for tracking
-                        self.active_polls[message.poll.id] = {
-                            "correct_index": correct_index,
-                            "chat_id": chat_id,
-                            "quiz_id": quiz_id
-                        }
-                        
-                        await asyncio.sleep(duration + 1)
-                    
-                    # Send Leaderboard
-                    results = self.quiz_results.get(session_key, {})
-                    if not results:
-                        await context.bot.send_message(chat_id=chat_id, text="🏁 Quiz yakunlandi. Hech kim ishtirok etmadi. 🤷‍♂️")
-                    else:
-                        # Sort by score (descending)
-                        sorted_users = sorted(results.values(), key=lambda x: x['score'], reverse=True)
-                        
-                        leaderboard = "🏆 **QUIZ NATIJALARI** 🏆\n\n"
-                        for i, user in enumerate(sorted_users[:10]): # Top 10
-                            medal = "🥇" if i == 0 else "🥈" if i == 1 else "🥉" if i == 2 else "👤"
-                            leaderboard += f"{medal} {user['name']}: **{user['score']}** / {len(quiz.quiz)}\n"
-                        
-                        await context.bot.send_message(
-                            chat_id=chat_id, 
-                            text=leaderboard, 
-                            parse_mode='Markdown'
-                        )
-                    
-                    # Cleanup (Optional: keep for a while or delete)
-                    # del self.quiz_results[session_key]
+                    # Polls are sent by whichever worker owns scheduling, so the handler returns right away
+                    await asyncio.to_thread(self.state.start_session, chat_id, quiz_id, duration)
                     return
                 except Exception as quiz_err:
                     logger.error(f"Quiz loading error: {quiz_err}")
-                    await update.message.reply_text(
+                    await self._reply(
+                        update,
                         f"❌ Kechirasiz, quizingizni yuklashda xatolik: {str(quiz_err)}\n"
                         "Ehtimol, server yangilangani uchun xotira o'chib ketgan. Iltimos, ilovada yangi quiz yarating."
                     )
@@ -158,7 +121,8 @@ class TelegramQuizBot:
             keyboard = [[InlineKeyboardButton("� Ilovani Ochish", web_app=WebAppInfo(url=self.app_url))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "Assalomu alaykum! **Testify AI** botiga xush kelibsiz! ✨\n\n"
                 "Sizda hali faol quiz seansi yo'q ekan. Quizingizni boshlash uchun:\n"
                 "1. Pastdagi tugma orqali ilovaga kiring.\n"
@@ -171,30 +135,153 @@ class TelegramQuizBot:
         except Exception as e:
             logger.error(f"Error in start_handler: {e}")
             try:
-                await update.message.reply_text(f"⚠️ Botda texnik xatolik: {str(e)}")
+                await self._reply(update, f"⚠️ Botda texnik xatolik: {str(e)}")
+            except: pass
+
+    async def _scheduler_tick(self, context: ContextTypes.DEFAULT_TYPE):
+        """Start the quiz steps that are due, if this worker owns scheduling"""
+        try:
+            owner = await asyncio.to_thread(
+                self.state.acquire_lease, SCHEDULER_LEASE, self.worker_id, SCHEDULER_LEASE_TTL
+            )
+            if not owner:
+                return
+            sessions = await asyncio.to_thread(self.state.due_sessions)
+        except Exception as e:
+            logger.error(f"Quiz scheduler error: {e}")
+            return
+        
+        # Steps run as tasks so one slow chat never holds up the others
+        for session in sessions:
+            context.application.create_task(self.quiz_step(context.bot, session))
+
+    async def quiz_step(self, bot: Bot, session: QuizSession):
+        """Send the next poll of a running quiz, or its leaderboard once all are sent"""
+        try:
+            quiz = await asyncio.to_thread(get_quiz_from_memory, session.quiz_id)
+            if session.next_index < len(quiz.quiz):
+                index = session.next_index
+                # Claimed before sending, so a later tick (or new owner) never sends it again;
+                # the provisional time only matters if this worker dies before the poll goes out
+                provisional_at = time.time() + session.duration + 1 + STEP_SEND_TIMEOUT
+                if not await asyncio.to_thread(self.state.claim_step, session, provisional_at):
+                    return
+                await self._send_question(bot, session, quiz, index)
+                # The poll may have waited in the flood-control queue; count its open period from now
+                next_at = time.time() + session.duration + 1
+                await asyncio.to_thread(self.state.schedule_next, session, next_at)
+                return
+            
+            if not await asyncio.to_thread(self.state.finish, session):
+                return
+            await self._send_leaderboard(bot, session, quiz)
+            await asyncio.to_thread(self.state.drop_results, session.key)
+        except Exception as e:
+            logger.error(f"Quiz step error in chat {session.chat_id}: {e}")
+            # `e` is unbound once the except block ends, before the scheduler calls the lambda
+            error_text = str(e)
+            try:
+                await asyncio.to_thread(self.state.finish, session)
+                await asyncio.to_thread(self.state.drop_results, session.key)
+                await self.sender.send(
+                    session.chat_id,
+                    lambda: bot.send_message(
+                        chat_id=session.chat_id,
+                        text=f"⚠️ Quizni davom ettirishda xatolik: {error_text}"
+                    ),
+                    PRIORITY_NORMAL
+                )
             except: pass
 
+    async def _send_question(self, bot: Bot, session: QuizSession, quiz, i: int):
+        q = quiz.quiz[i]
+        options = [opt for opt in q.options.values()]
+        opt_keys = list(q.options.keys())
+        try:
+            correct_index = opt_keys.index(q.correct_answer)
+        except ValueError:
+            correct_index = 0
+        
+        message = await self.sender.send(
+            session.chat_id,
+            lambda: bot.send_poll(
+                chat_id=session.chat_id,
+                question=f"{i+1}. {q.question}",
+                options=options,
+                type=Poll.QUIZ,
+                correct_option_id=correct_index,
+                is_anonymous=False,
+                open_period=session.duration,
+                explanation="To'g'ri javobni tanlang."
+            ),
+            PRIORITY_HIGH
+        )
+        
+        # Register poll for tracking; answers may reach any worker
+        await asyncio.to_thread(
+            self.state.add_poll, message.poll.id, correct_index, session.chat_id, session.quiz_id, session.duration
+        )
+
+    async def _send_leaderboard(self, bot: Bot, session: QuizSession, quiz):
+        chat_id = session.chat_id
+        results = await asyncio.to_thread(self.state.get_results, session.key)
+        if not results:
+            await self.sender.send(
+                chat_id,
+                lambda: bot.send_message(chat_id=chat_id, text="🏁 Quiz yakunlandi. Hech kim ishtirok etmadi. 🤷‍♂️"),
+                PRIORITY_HIGH
+            )
+            return
+        
+        # Sort by score (descending)
+        sorted_users = sorted(results.values(), key=lambda x: x.score, reverse=True)
+        
+        leaderboard = "🏆 **QUIZ NATIJALARI** 🏆\n\n"
+        for i, user in enumerate(sorted_users[:10]): # Top 10
+            medal = "🥇" if i == 0 else "🥈" if i == 1 else "🥉" if i == 2 else "👤"
+            leaderboard += f"{medal} {user.name}: **{user.score}** / {len(quiz.quiz)}\n"
+        
+        await self.sender.send(
+            chat_id,
+            lambda: bot.send_message(
+                chat_id=chat_id, 
+                text=leaderboard, 
+                parse_mode='Markdown'
+            ),
+            PRIORITY_HIGH
+        )
+
+    async def _reply(self, update: Update, text: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        """Reply to the message of an update through the send scheduler"""
+        return await self.sender.send(
+            update.effective_chat.id,
+            lambda: update.message.reply_text(text, **kwargs),
+            priority
+        )
+
     async def ping_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text("Pong! 🏓 Bot ishlayapti.")
+        await self._reply(update, "Pong! 🏓 Bot ishlayapti.", PRIORITY_LOW)
 
     async def debug_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        sessions = _load_sessions()
-        last_quiz = sessions.get(str(user_id), "Yo'q")
+        last_quiz = await asyncio.to_thread(self.state.get_last_quiz, user_id) or "Yo'q"
         
         status = (
             f"🔍 **Debug Ma'lumotlari**\n"
             f"User ID: `{user_id}`\n"
             f"Chat ID: `{update.effective_chat.id}`\n"
             f"Oxirgi Quiz: `{last_quiz}`\n"
-            f"Aktiv Polls: `{len(self.active_polls)}`\n"
+            f"Aktiv Polls: `{await asyncio.to_thread(self.state.poll_count)}`\n"
+            f"Aktiv Quizlar: `{await asyncio.to_thread(self.state.session_count)}`\n"
+            f"Navbatdagi xabarlar: `{self.sender.pending()}`\n"
             f"Server holati: ✅ Ishlayapti"
         )
-        await update.message.reply_text(status, parse_mode='Markdown')
+        await self._reply(update, status, PRIORITY_LOW, parse_mode='Markdown')
 
     async def message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message and update.effective_chat.type == "private":
-            await update.message.reply_text(
+            await self._reply(
+                update,
                 "Men faqat buyruqlarga javob bera olaman. Ilovani ishlash uchun pastdagi 'Ilovani Ochish' tugmasini bosing. 👇"
             )
 
@@ -203,35 +290,111 @@ class TelegramQuizBot:
         answer = update.poll_answer
         poll_id = answer.poll_id
         
-        if poll_id in self.active_polls:
-            poll_info = self.active_polls[poll_id]
-            chat_id = poll_info["chat_id"]
-            quiz_id = poll_info["quiz_id"]
-            correct_index = poll_info["correct_index"]
-            
-            session_key = (chat_id, quiz_id)
-            user_id = answer.user.id
-            user_name = answer.user.full_name
-            
-            if session_key not in self.quiz_results:
-                self.quiz_results[session_key] = {}
-            
-            if user_id not in self.quiz_results[session_key]:
-                self.quiz_results[session_key][user_id] = {
-                    "name": user_name,
-                    "score": 0,
-                    "answers": 0
-                }
-            
-            # Check if answer is correct
-            if answer.option_ids and answer.option_ids[0] == correct_index:
-                self.quiz_results[session_key][user_id]["score"] += 1
-            
-            self.quiz_results[session_key][user_id]["answers"] += 1
+        poll_info = await asyncio.to_thread(self.state.get_poll, poll_id)
+        if poll_info is None:
+            return
+        
+        # Check if answer is correct
+        correct = bool(answer.option_ids) and answer.option_ids[0] == poll_info.correct_index
+        await asyncio.to_thread(
+            self.state.record_answer,
+            (poll_info.chat_id, poll_info.quiz_id),
+            answer.user.id,
+            answer.user.full_name,
+            correct
+        )
 
-    def run_in_background(self):
+    def _start_scheduler(self):
+        """
+        Tick on every worker; only the holder of the scheduler lease sends quiz steps
+
+        Sessions live in the shared database, so quizzes that were running
+        before a redeploy or a worker crash resume once a worker (re)takes the lease.
+        """
+        self.application.job_queue.run_repeating(self._scheduler_tick, interval=SCHEDULER_TICK, first=0)
+
+    def release_scheduler(self):
+        """Hand scheduling to another worker right away instead of after the lease expires"""
+        try:
+            self.state.release_lease(SCHEDULER_LEASE, self.worker_id)
+        except Exception as e:
+            logger.error(f"Error releasing quiz scheduler lease: {e}")
+
+    def _has_token(self) -> bool:
         if not self.token or self.token == "your-telegram-bot-token-here":
             logger.warning("Telegram Bot Token topilmadi. Bot o'chirilgan.")
+            return False
+        return True
+
+    def _build_application(self, polling: bool):
+        builder = ApplicationBuilder().token(self.token).base_url(settings.TELEGRAM_API_BASE_URL)
+        if not polling:
+            # Updates arrive through the FastAPI webhook route instead
+            builder = builder.updater(None)
+        # Handlers never block on a running quiz, so updates can be processed concurrently
+        self.application = builder.concurrent_updates(True).build()
+        self.application.add_handler(CommandHandler("start", self.start_handler))
+        self.application.add_handler(CommandHandler("ping", self.ping_handler))
+        self.application.add_handler(CommandHandler("debug", self.debug_handler))
+        self.application.add_handler(PollAnswerHandler(self.poll_answer_handler))
+        self.application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self.message_handler))
+
+    @property
+    def webhook_secret(self) -> str:
+        # Derived from the token when not configured, so every worker agrees on it
+        return settings.TELEGRAM_WEBHOOK_SECRET or hashlib.sha256(self.token.encode()).hexdigest()
+
+    async def start_webhook(self):
+        """Run the bot on the current (FastAPI) event loop and register the webhook"""
+        if not self._has_token():
+            return
+        
+        self._build_application(polling=False)
+        await self.application.initialize()
+        await self.application.start()
+        self._start_scheduler()
+        
+        webhook_url = settings.TELEGRAM_WEBHOOK_URL.rstrip("/") + "/api/telegram/webhook"
+        await self.application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=self.webhook_secret,
+            allowed_updates=Update.ALL_TYPES
+        )
+        await self.set_menu_button()
+        logger.info(f"Telegram Bot webhook set to {webhook_url}")
+
+    async def stop_webhook(self):
+        if self.application is None or self.application.updater is not None:
+            return
+        await self.application.stop()
+        self.release_scheduler()
+        await self.application.shutdown()
+
+    def webhook_authorized(self, secret: Optional[str]) -> bool:
+        """True if webhook mode is on and the secret token of a webhook request matches"""
+        if self.application is None or self.application.updater is not None:
+            return False
+        return hmac.compare_digest(secret or "", self.webhook_secret)
+
+    async def process_webhook_update(self, data: dict) -> bool:
+        """
+        Queue an update received on the webhook route, once webhook_authorized() passed
+        
+        Returns:
+            False if `data` is not a valid update
+        """
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.warning(f"Invalid webhook update: {e}")
+            return False
+        if update is None:
+            return False
+        await self.application.update_queue.put(update)
+        return True
+
+    def run_in_background(self):
+        if not self._has_token():
             return
             
         def run():
@@ -239,15 +402,11 @@ class TelegramQuizBot:
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
                 
-                self.application = ApplicationBuilder().token(self.token).build()
-                self.application.add_handler(CommandHandler("start", self.start_handler))
-                self.application.add_handler(CommandHandler("ping", self.ping_handler))
-                self.application.add_handler(CommandHandler("debug", self.debug_handler))
-                self.application.add_handler(PollAnswerHandler(self.poll_answer_handler))
-                self.application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self.message_handler))
+                self._build_application(polling=True)
                 
                 loop.run_until_complete(self.application.initialize())
                 loop.run_until_complete(self.application.start())
+                self._start_scheduler()
                 loop.run_until_complete(self.application.updater.start_polling())
                 loop.run_until_complete(self.set_menu_button())
                 
@@ -261,3 +420,8 @@ class TelegramQuizBot:
 
 # Global instance
 telegram_bot = TelegramQuizBot()
+
+ACTIVE_SESSIONS = Gauge(
+    "testify_telegram_active_quiz_sessions", "Quizzes currently being played in Telegram chats",
+    function=lambda: telegram_bot.state.session_count()
+)
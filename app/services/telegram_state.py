@@ -0,0 +1,328 @@
+"""
+Telegram quiz polls, scores and running sessions, shared by all workers through SQLite
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.db import SQLiteDatabase
+
+# Poll answers can only arrive while a poll is open; keep a little slack for late updates
+POLL_GRACE_PERIOD = 60
+# How often expired entries are swept (seconds)
+PURGE_INTERVAL = 60
+
+SessionKey = Tuple[int, str]
+
+
+class PollInfo:
+    """A quiz poll waiting for answers"""
+    __slots__ = ("correct_index", "chat_id", "quiz_id")
+
+    def __init__(self, correct_index: int, chat_id: int, quiz_id: str):
+        self.correct_index = correct_index
+        self.chat_id = chat_id
+        self.quiz_id = quiz_id
+
+
+class Participant:
+    """Score of one user in one quiz session"""
+    __slots__ = ("name", "score", "answers")
+
+    def __init__(self, name: str, score: int = 0, answers: int = 0):
+        self.name = name
+        self.score = score
+        self.answers = answers
+
+
+class QuizSession:
+    """
+    Progress of a quiz being played in one chat
+
+    `started_at` identifies one run of the quiz: restarting it in the same chat
+    replaces the row, and steps claimed for the old run no longer match.
+    """
+    __slots__ = ("chat_id", "quiz_id", "duration", "next_index", "next_at", "started_at")
+
+    def __init__(
+        self,
+        chat_id: int,
+        quiz_id: str,
+        duration: int,
+        next_index: int,
+        next_at: float,
+        started_at: float
+    ):
+        self.chat_id = chat_id
+        self.quiz_id = quiz_id
+        self.duration = duration
+        self.next_index = next_index
+        self.next_at = next_at
+        self.started_at = started_at
+
+    @property
+    def key(self) -> SessionKey:
+        return (self.chat_id, self.quiz_id)
+
+
+class QuizBotState:
+    """
+    Polls, scores and running sessions of the Telegram bot.
+
+    Everything lives in the SQLite database of the quiz store, so every
+    uvicorn worker sees the same polls and scores no matter which one
+    Telegram delivers a webhook update to. Sessions are advanced by a single
+    scheduling owner per database, elected through a lease row (see
+    acquire_lease()); each step is additionally claimed with a conditional
+    UPDATE, so a step is never sent twice even while ownership changes hands.
+    The lease only coordinates processes that open the same database file,
+    i.e. workers on one host. The quiz each user last opened through a deep
+    link is kept there too, for /start without arguments.
+
+    Polls expire shortly after their open_period ends. Scores are dropped
+    once the leaderboard is sent, or `result_ttl` seconds after the last
+    activity for abandoned sessions, so the tables stay small over long uptimes.
+    """
+
+    def __init__(self, db: SQLiteDatabase, result_ttl: int, legacy_sessions_file: Optional[str] = None):
+        self.db = db
+        self.result_ttl = result_ttl
+        self._next_purge = 0.0
+        self._init_db()
+        if legacy_sessions_file:
+            self._import_legacy_sessions(legacy_sessions_file)
+
+    def _init_db(self):
+        conn = self.db.connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS telegram_polls ("
+            " poll_id TEXT PRIMARY KEY,"
+            " correct_index INTEGER NOT NULL,"
+            " chat_id INTEGER NOT NULL,"
+            " quiz_id TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS telegram_scores ("
+            " chat_id INTEGER NOT NULL,"
+            " quiz_id TEXT NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " name TEXT NOT NULL,"
+            " score INTEGER NOT NULL,"
+            " answers INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (chat_id, quiz_id, user_id))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS telegram_sessions ("
+            " chat_id INTEGER NOT NULL,"
+            " quiz_id TEXT NOT NULL,"
+            " duration INTEGER NOT NULL,"
+            " next_index INTEGER NOT NULL,"
+            " next_at REAL NOT NULL,"
+            " started_at REAL NOT NULL,"
+            " PRIMARY KEY (chat_id, quiz_id))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS telegram_last_quiz ("
+            " user_id INTEGER PRIMARY KEY,"
+            " quiz_id TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS telegram_leases ("
+            " name TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS telegram_polls_expires ON telegram_polls (expires_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS telegram_sessions_next ON telegram_sessions (next_at)")
+
+    def _import_legacy_sessions(self, path: str):
+        """One-time import of the old user_sessions.json map of user ID -> last quiz ID"""
+        if not os.path.exists(path):
+            return
+        conn = self.db.connection()
+        if conn.execute("SELECT 1 FROM telegram_last_quiz LIMIT 1").fetchone():
+            return
+        try:
+            with open(path, "r") as f:
+                legacy = json.load(f)
+            rows = [(int(user_id), quiz_id) for user_id, quiz_id in legacy.items()]
+        except Exception:
+            return
+        conn.executemany("INSERT OR IGNORE INTO telegram_last_quiz VALUES (?, ?)", rows)
+
+    # Last quiz per user
+
+    def set_last_quiz(self, user_id: int, quiz_id: str):
+        self.db.connection().execute(
+            "INSERT OR REPLACE INTO telegram_last_quiz VALUES (?, ?)", (user_id, quiz_id)
+        )
+
+    def get_last_quiz(self, user_id: int) -> Optional[str]:
+        row = self.db.connection().execute(
+            "SELECT quiz_id FROM telegram_last_quiz WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # Polls
+
+    def add_poll(self, poll_id: str, correct_index: int, chat_id: int, quiz_id: str, open_period: int):
+        self.db.connection().execute(
+            "INSERT OR REPLACE INTO telegram_polls VALUES (?, ?, ?, ?, ?)",
+            (poll_id, correct_index, chat_id, quiz_id, time.time() + open_period + POLL_GRACE_PERIOD)
+        )
+        self._maybe_purge()
+
+    def get_poll(self, poll_id: str) -> Optional[PollInfo]:
+        row = self.db.connection().execute(
+            "SELECT correct_index, chat_id, quiz_id FROM telegram_polls"
+            " WHERE poll_id = ? AND expires_at >= ?",
+            (poll_id, time.time())
+        ).fetchone()
+        return PollInfo(*row) if row else None
+
+    def poll_count(self) -> int:
+        return self.db.connection().execute(
+            "SELECT COUNT(*) FROM telegram_polls WHERE expires_at >= ?", (time.time(),)
+        ).fetchone()[0]
+
+    # Scores
+
+    def record_answer(self, key: SessionKey, user_id: int, name: str, correct: bool):
+        chat_id, quiz_id = key
+        self.db.connection().execute(
+            "INSERT INTO telegram_scores VALUES (?, ?, ?, ?, ?, 1, ?)"
+            " ON CONFLICT (chat_id, quiz_id, user_id) DO UPDATE SET"
+            " name = excluded.name,"
+            " score = score + excluded.score,"
+            " answers = answers + 1,"
+            " expires_at = excluded.expires_at",
+            (chat_id, quiz_id, user_id, name, int(correct), time.time() + self.result_ttl)
+        )
+
+    def get_results(self, key: SessionKey) -> Dict[int, Participant]:
+        rows = self.db.connection().execute(
+            "SELECT user_id, name, score, answers FROM telegram_scores WHERE chat_id = ? AND quiz_id = ?",
+            key
+        )
+        return {user_id: Participant(name, score, answers) for user_id, name, score, answers in rows}
+
+    def drop_results(self, key: SessionKey):
+        self.db.connection().execute(
+            "DELETE FROM telegram_scores WHERE chat_id = ? AND quiz_id = ?", key
+        )
+
+    # Sessions
+
+    def start_session(self, chat_id: int, quiz_id: str, duration: int) -> QuizSession:
+        """(Re)start a quiz in a chat with empty scores; its first step is due right away"""
+        now = time.time()
+        session = QuizSession(chat_id, quiz_id, duration, 0, now, now)
+        conn = self.db.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM telegram_scores WHERE chat_id = ? AND quiz_id = ?", session.key)
+            conn.execute(
+                "INSERT OR REPLACE INTO telegram_sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, quiz_id, duration, 0, now, now)
+            )
+        return session
+
+    def due_sessions(self, limit: int = 100) -> List[QuizSession]:
+        rows = self.db.connection().execute(
+            "SELECT chat_id, quiz_id, duration, next_index, next_at, started_at FROM telegram_sessions"
+            " WHERE next_at <= ? ORDER BY next_at LIMIT ?",
+            (time.time(), limit)
+        )
+        return [QuizSession(*row) for row in rows]
+
+    def claim_step(self, session: QuizSession, next_at: float) -> bool:
+        """
+        Take the session's current step and schedule the following one at `next_at`
+
+        Returns:
+            False if another worker or tick already took this step, or the
+            quiz was restarted or finished in the meantime
+        """
+        cursor = self.db.connection().execute(
+            "UPDATE telegram_sessions SET next_index = next_index + 1, next_at = ?"
+            " WHERE chat_id = ? AND quiz_id = ? AND next_index = ? AND started_at = ?",
+            (next_at, session.chat_id, session.quiz_id, session.next_index, session.started_at)
+        )
+        return cursor.rowcount == 1
+
+    def schedule_next(self, session: QuizSession, next_at: float) -> bool:
+        """
+        Move the step that follows the one claimed from `session` to `next_at`
+
+        Returns:
+            False if the quiz was restarted or finished in the meantime
+        """
+        cursor = self.db.connection().execute(
+            "UPDATE telegram_sessions SET next_at = ?"
+            " WHERE chat_id = ? AND quiz_id = ? AND next_index = ? AND started_at = ?",
+            (next_at, session.chat_id, session.quiz_id, session.next_index + 1, session.started_at)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, session: QuizSession) -> bool:
+        """
+        Remove a session whose last step is due; its scores stay until drop_results()
+
+        Returns:
+            False if the session was already finished or restarted
+        """
+        cursor = self.db.connection().execute(
+            "DELETE FROM telegram_sessions"
+            " WHERE chat_id = ? AND quiz_id = ? AND started_at = ?",
+            (session.chat_id, session.quiz_id, session.started_at)
+        )
+        return cursor.rowcount == 1
+
+    def session_count(self) -> int:
+        return self.db.connection().execute("SELECT COUNT(*) FROM telegram_sessions").fetchone()[0]
+
+    # Scheduling ownership
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        Take or renew the lease `name` for `owner` for `ttl` seconds
+
+        Returns:
+            True while `owner` holds the lease; another owner can only take it
+            over once it has not been renewed for `ttl` seconds
+        """
+        now = time.time()
+        cursor = self.db.connection().execute(
+            "INSERT INTO telegram_leases VALUES (?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+            " WHERE telegram_leases.owner = excluded.owner OR telegram_leases.expires_at < ?",
+            (name, owner, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, name: str, owner: str):
+        self.db.connection().execute(
+            "DELETE FROM telegram_leases WHERE name = ? AND owner = ?", (name, owner)
+        )
+
+    # Expiry
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now >= self._next_purge:
+            self._next_purge = now + PURGE_INTERVAL
+            self.purge(now)
+
+    def purge(self, now: Optional[float] = None):
+        now = now or time.time()
+        conn = self.db.connection()
+        conn.execute("DELETE FROM telegram_polls WHERE expires_at < ?", (now,))
+        conn.execute(
+            "DELETE FROM telegram_scores WHERE expires_at < ? AND NOT EXISTS ("
+            " SELECT 1 FROM telegram_sessions s"
+            " WHERE s.chat_id = telegram_scores.chat_id AND s.quiz_id = telegram_scores.quiz_id)",
+            (now,)
+        )
@@ -0,0 +1,27 @@
+"""
+SQLite helpers shared by the embedded stores
+"""
+import sqlite3
+import threading
+
+
+class SQLiteDatabase:
+    """
+    Lazily opens one WAL-mode connection per thread.
+
+    sqlite3 connections cannot be shared across threads (the Telegram bot runs
+    in its own thread), so each thread gets its own autocommit connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,54 @@
+"""
+Request deadlines shared by everything a request waits on
+"""
+import math
+import time
+from typing import Optional
+
+
+class Deadline:
+    """
+    Point in time by which a request's work must be finished
+
+    Created from a timeout in seconds; a missing or non-positive timeout means
+    no deadline. Work shared by several requests keeps the latest of their
+    deadlines (see extend()).
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout if timeout and timeout > 0 else math.inf
+
+    def remaining(self) -> float:
+        """Seconds left (inf without a deadline, never negative)"""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def timeout(self) -> Optional[float]:
+        """remaining() for APIs that take None as "no timeout" """
+        return None if self.expires_at == math.inf else self.remaining()
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def covers(self, seconds: float) -> bool:
+        """Whether `seconds` of work still fit before the deadline"""
+        return self.remaining() >= seconds
+
+    def extend(self, other: "Deadline"):
+        """Move this deadline to `other` if that one is later"""
+        self.expires_at = max(self.expires_at, other.expires_at)
+
+
+def parse_timeout(value: Optional[str], default: float) -> float:
+    """
+    Timeout in seconds from a request header, capped at the server default
+
+    Clients may ask for less time than the server allows, never more; a
+    missing or invalid value gives the default.
+    """
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(timeout) or timeout <= 0:
+        return default
+    return min(timeout, default) if default > 0 else timeout
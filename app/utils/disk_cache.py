@@ -0,0 +1,113 @@
+"""
+Size-bounded key/value cache persisted in SQLite
+"""
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from app.utils.db import SQLiteDatabase
+
+
+class DiskCache:
+    """
+    Persistent string cache with TTL expiry and size-based LRU eviction.
+
+    Entries expire after `ttl` seconds (0 = never); once the stored values
+    exceed `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, db_path: str, ttl: int, max_bytes: int, table: str = "entries"):
+        self.db = SQLiteDatabase(db_path)
+        self.table = table
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self.db.connection()
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            " key TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_raw(self, key: str) -> Optional[str]:
+        """Return the stored value for this key, or None on a miss"""
+        conn = self._connect()
+        row = conn.execute(
+            f"SELECT data, created_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+
+        now = time.time()
+        if row is None or (self.ttl > 0 and row[1] + self.ttl < now):
+            if row is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._count(hit=False)
+            return None
+
+        conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+        self._count(hit=True)
+        return row[0]
+
+    def put_raw(self, key: str, data: str) -> None:
+        """Store a value and evict expired or least recently used entries"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, data, size, created_at, last_used)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data), now, now)
+        )
+        self._evict(now)
+
+    def _evict(self, now: float):
+        conn = self._connect()
+        if self.ttl > 0:
+            conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,))
+        if self.max_bytes <= 0:
+            return
+
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        victims = []
+        for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_used").fetchall():
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current cache size"""
+        entries, size = self._connect().execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+        ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
@@ -0,0 +1,85 @@
+"""
+Incremental parsing of JSON arrays that arrive in pieces
+"""
+import json
+from typing import Any, List
+
+
+class JSONArrayItemParser:
+    """
+    Pulls complete objects out of a JSON array while the document is still
+    streaming in.
+
+    Feed it text as it arrives; every object element of the first array found
+    after `array_key` is returned as soon as its closing brace has been seen.
+    Anything before the array (markdown fences, the opening `{"quiz":`) and
+    after it is ignored.
+    """
+
+    def __init__(self, array_key: str = "quiz"):
+        self.array_key = f'"{array_key}"'
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = -1
+
+    def feed(self, text: str) -> List[Any]:
+        """Add text and return the items completed by it"""
+        if self._done:
+            return []
+        self._buffer += text
+        items = []
+
+        if not self._in_array:
+            key_pos = self._buffer.find(self.array_key)
+            if key_pos < 0:
+                return items
+            bracket = self._buffer.find("[", key_pos)
+            if bracket < 0:
+                return items
+            self._in_array = True
+            self._pos = bracket + 1
+
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._item_start = pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the array itself
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._item_start >= 0:
+                    raw = buffer[self._item_start:pos + 1]
+                    self._item_start = -1
+                    try:
+                        items.append(json.loads(raw))
+                    except ValueError:
+                        pass
+            pos += 1
+
+        # Drop text that can no longer be part of an item
+        keep_from = self._item_start if self._item_start >= 0 else pos
+        self._buffer = buffer[keep_from:]
+        if self._item_start >= 0:
+            self._item_start = 0
+        self._pos = pos - keep_from
+        return items
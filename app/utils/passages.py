@@ -0,0 +1,141 @@
+"""
+Picking the most informative passages of a document for a size-limited prompt
+"""
+import math
+import re
+from collections import Counter
+from typing import List
+
+# Rough size of a token for Latin-script text; good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+# Passages are whole sentences grouped up to about this many characters
+PASSAGE_CHARS = 600
+# A short line seen this many times is a running header or footer
+REPEATED_LINE_MIN = 3
+# Passages with fewer words carry too little content to be worth a slot
+MIN_PASSAGE_WORDS = 6
+
+_WORD = re.compile(r"[^\W\d_]{3,}")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+# Table of contents entries: "Kirish ........ 3", "2.1 Tarix    15"
+_TOC_LINE = re.compile(r"^.{2,100}?(\.{3,}|…+|_{3,}|\s{3,}|\t)\s*\d{1,4}\s*$")
+# Bare page numbers: "12", "- 12 -", "Page 3 of 10", "5-bet"
+_PAGE_LINE = re.compile(r"^\W*((page|sahifa|bet)\s*)?\d{1,4}(\s*(of|/)\s*\d{1,4})?(-?(bet|sahifa))?\W*$", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def remove_boilerplate(text: str) -> str:
+    """
+    Drop running headers/footers, page numbers and table of contents lines
+
+    A header is any short line that repeats at least REPEATED_LINE_MIN times
+    (digits ignored, so "Chapter 2 - 14" and "Chapter 2 - 15" count as the
+    same line). Blank lines are kept so paragraph breaks survive.
+    """
+    lines = text.splitlines()
+    keys = [_line_key(line) for line in lines]
+    counts = Counter(key for key in keys if key)
+
+    kept = []
+    for line, key in zip(lines, keys):
+        stripped = line.strip()
+        if not stripped:
+            kept.append("")
+            continue
+        if key and counts[key] >= REPEATED_LINE_MIN:
+            continue
+        if _PAGE_LINE.match(stripped) or _TOC_LINE.match(stripped):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def _line_key(line: str) -> str:
+    stripped = line.strip()
+    if not stripped or len(stripped) > 100:
+        return ""
+    return re.sub(r"\d+", "#", stripped.lower())
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS) -> List[str]:
+    """Split text into passages of whole sentences, never across paragraphs"""
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        # PDF text is hard-wrapped; sentences continue across single newlines
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        current = ""
+        for sentence in _SENTENCE_END.split(paragraph):
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+            while len(current) > max_chars * 2:
+                # A "sentence" this long has no punctuation; cut it at a space
+                cut = current.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                passages.append(current[:cut])
+                current = current[cut:].lstrip()
+        if current:
+            passages.append(current)
+    return passages
+
+
+def select_passages(text: str, token_budget: int) -> str:
+    """
+    Fit the most informative part of a document into `token_budget` tokens
+
+    Text that already fits is returned unchanged. Otherwise boilerplate is
+    removed, the rest is split into sentence-aligned passages, each passage is
+    scored by the average TF-IDF weight of its words (passages made of terms
+    found everywhere, or of digits and symbols, score low) and the best ones
+    are packed into the budget. Selected passages keep their original order.
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    passages = split_passages(remove_boilerplate(text))
+    words = [_WORD.findall(passage.lower()) for passage in passages]
+
+    document_frequency = Counter()
+    for passage_words in words:
+        document_frequency.update(set(passage_words))
+    n = len(passages)
+
+    scored = []
+    seen = set()
+    for i, (passage, passage_words) in enumerate(zip(passages, words)):
+        if len(passage_words) < MIN_PASSAGE_WORDS:
+            continue
+        fingerprint = " ".join(passage_words)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+
+        weight = sum(
+            (1 + math.log(tf)) * (math.log((1 + n) / (1 + document_frequency[word])) + 1)
+            for word, tf in Counter(passage_words).items()
+        )
+        letters = sum(len(word) for word in passage_words)
+        density = letters / max(len(passage.replace(" ", "")), 1)
+        scored.append((weight / len(passage_words) * density, i))
+
+    chosen = []
+    used = 0
+    for _, i in sorted(scored, reverse=True):
+        size = len(passages[i]) + 2
+        if used + size > budget_chars:
+            continue
+        chosen.append(i)
+        used += size
+        if budget_chars - used < PASSAGE_CHARS // 4:
+            break
+
+    if not chosen:
+        return text[:budget_chars]
+    return "\n\n".join(passages[i] for i in sorted(chosen))
@@ -0,0 +1,150 @@
+"""
+Local stand-in for the Gemini API (plain gRPC) for benchmarks
+
+Answers GenerateContent and StreamGenerateContent with a well-formed quiz
+for the requested number of questions, after a configurable delay. A share
+of calls can be failed with 429 (RESOURCE_EXHAUSTED, with a retry hint) or
+answered with malformed JSON, to exercise the key pool and the salvaging
+parser. Point the app at it with GEMINI_API_ENDPOINT=127.0.0.1:<port>.
+
+    python -m benchmarks.fake_gemini --port 50061 --latency 0.8 --rate-limit 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import signal
+
+import grpc
+from google.ai import generativelanguage as glm
+
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+MALFORMED_KINDS = ("truncated", "trailing_comma", "missing_option", "fenced", "bad_answer")
+
+
+class FakeGemini:
+    def __init__(self, latency: float, jitter: float, rate_limit: float, malformed: float,
+                 stream_chunks: int, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.malformed = malformed
+        self.stream_chunks = stream_chunks
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "rate_limited": 0, "malformed": 0}
+
+    async def generate_content(self, request, context):
+        text = await self._answer(request, context)
+        return _response(text)
+
+    async def stream_generate_content(self, request, context):
+        text = await self._answer(request, context)
+        size = max(1, len(text) // self.stream_chunks)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(self.latency / self.stream_chunks / 4)
+            yield _response(text[start:start + size])
+
+    async def _answer(self, request, context) -> str:
+        self.stats["requests"] += 1
+        delay = max(0.0, self.random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        await asyncio.sleep(delay)
+
+        if self.random.random() < self.rate_limit:
+            self.stats["rate_limited"] += 1
+            await context.abort(
+                grpc.StatusCode.RESOURCE_EXHAUSTED,
+                "Resource has been exhausted (e.g. check quota). Please retry in 2s."
+            )
+
+        prompt = request.contents[0].parts[0].text if request.contents else ""
+        match = re.search(r"Savollar soni: (\d+)", prompt)
+        quiz = _quiz(int(match.group(1)) if match else 10, self.random)
+        if self.random.random() < self.malformed:
+            self.stats["malformed"] += 1
+            return _malform(quiz, self.random.choice(MALFORMED_KINDS))
+        return json.dumps(quiz, ensure_ascii=False)
+
+
+def _response(text: str) -> glm.GenerateContentResponse:
+    return glm.GenerateContentResponse(candidates=[
+        glm.Candidate(
+            content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+            finish_reason=glm.Candidate.FinishReason.STOP,
+            index=0
+        )
+    ])
+
+
+def _quiz(count: int, rng: random.Random) -> dict:
+    questions = []
+    for i in range(count):
+        token = rng.randrange(10 ** 6)
+        questions.append({
+            "question": f"Savol {i + 1} ({token}): matnga ko'ra qaysi javob to'g'ri?",
+            "options": {letter: f"Variant {letter} {token}" for letter in "ABCD"},
+            "correct_answer": rng.choice("ABCD")
+        })
+    return {"quiz": questions}
+
+
+def _malform(quiz: dict, kind: str) -> str:
+    if kind == "truncated":
+        text = json.dumps(quiz, ensure_ascii=False)
+        return text[:int(len(text) * 0.7)]
+    if kind == "trailing_comma":
+        return json.dumps(quiz, ensure_ascii=False).replace("}]", "},]")
+    if kind == "missing_option":
+        quiz["quiz"][0]["options"].pop("D", None)
+        quiz["quiz"][0]["options"]["C"] = ""
+    elif kind == "bad_answer":
+        quiz["quiz"][0]["correct_answer"] = "A va C"
+    elif kind == "fenced":
+        return "```json\n" + json.dumps(quiz, ensure_ascii=False) + "\n```"
+    return json.dumps(quiz, ensure_ascii=False)
+
+
+async def serve(port: int, fake: FakeGemini):
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(SERVICE, {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            fake.generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize
+        ),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            fake.stream_generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize
+        ),
+    }),))
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    await server.start()
+    print(f"Fake Gemini listening on 127.0.0.1:{port}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await server.stop(grace=1)
+    print(json.dumps(fake.stats), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=50061)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Standard deviation of the latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Share of calls failed with 429")
+    parser.add_argument("--malformed", type=float, default=0.0, help="Share of calls answered with broken JSON")
+    parser.add_argument("--stream-chunks", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeGemini(args.latency, args.jitter, args.rate_limit, args.malformed, args.stream_chunks, args.seed)
+    asyncio.run(serve(args.port, fake))
+
+
+if __name__ == "__main__":
+    main()
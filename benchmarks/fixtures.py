@@ -0,0 +1,122 @@
+"""
+Deterministic PDF/DOCX/TXT documents for benchmarks
+
+The files are generated rather than checked in: the same seed always gives
+the same bytes, so runs on different machines upload identical inputs.
+"""
+import io
+import os
+import random
+import re
+import zipfile
+from datetime import datetime
+from typing import Dict, List
+
+import fitz  # PyMuPDF
+from docx import Document
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_TEXT = os.path.join(REPO_ROOT, "test_uzbekistan.txt")
+FALLBACK_SENTENCES = [
+    "O'zbekiston Respublikasi Markaziy Osiyoda joylashgan mustaqil davlat.",
+    "Poytaxti Toshkent shahri bo'lib, u mintaqaning eng yirik shahri hisoblanadi.",
+    "Mamlakat tarixda Buyuk Ipak yo'lining muhim qismi bo'lgan.",
+    "Samarqand, Buxoro va Xiva kabi qadimiy shaharlar dunyoga mashhur.",
+]
+# Characters of text per PDF page
+PAGE_CHARS = 1800
+FIXED_DATE = datetime(2024, 1, 1)
+
+
+def _sentences() -> List[str]:
+    if os.path.exists(SAMPLE_TEXT):
+        with open(SAMPLE_TEXT, "r", encoding="utf-8") as f:
+            text = f.read()
+        sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.strip()) > 20]
+        if sentences:
+            return sentences
+    return FALLBACK_SENTENCES
+
+
+def lecture_sections(chars: int, seed: int = 1) -> List[tuple]:
+    """(heading, [paragraphs]) sections totalling about `chars` characters"""
+    rng = random.Random(seed)
+    sentences = _sentences()
+    sections = []
+    size = 0
+    while size < chars:
+        number = len(sections) + 1
+        paragraphs = []
+        for _ in range(rng.randint(2, 4)):
+            picked = [rng.choice(sentences) for _ in range(rng.randint(3, 6))]
+            # Vary numbers and add a section-specific term so passages differ
+            paragraph = " ".join(picked) + f" {number}-mavzu bo'yicha {rng.randint(1000, 9999)} ta manba o'rganilgan."
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        sections.append((f"{number}-bob. Mavzu {number}", paragraphs))
+    return sections
+
+
+def lecture_text(chars: int, seed: int = 1) -> str:
+    return "\n\n".join(
+        heading + "\n\n" + "\n\n".join(paragraphs)
+        for heading, paragraphs in lecture_sections(chars, seed)
+    )
+
+
+def write_txt(path: str, chars: int, seed: int = 1):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(lecture_text(chars, seed))
+
+
+def write_pdf(path: str, chars: int, seed: int = 1):
+    text = lecture_text(chars, seed)
+    doc = fitz.open()
+    for number, start in enumerate(range(0, len(text), PAGE_CHARS), 1):
+        page = doc.new_page()
+        # Running header and page number, like exported lecture slides
+        page.insert_text((72, 40), "Ma'ruza matnlari - Benchmark", fontsize=9)
+        page.insert_textbox(fitz.Rect(72, 60, 540, 760), text[start:start + PAGE_CHARS], fontsize=10)
+        page.insert_text((300, 800), str(number), fontsize=9)
+    # No timestamps or random file ID, so the bytes only depend on the seed
+    doc.set_metadata({"producer": "testify-benchmarks", "creationDate": "", "modDate": ""})
+    doc.save(path, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def write_docx(path: str, chars: int, seed: int = 1):
+    document = Document()
+    document.core_properties.created = FIXED_DATE
+    document.core_properties.modified = FIXED_DATE
+    for heading, paragraphs in lecture_sections(chars, seed):
+        document.add_heading(heading, level=2)
+        for paragraph in paragraphs:
+            document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    # Zip entries carry the current time; rewrite them with a fixed one. A ZipInfo
+    # defaults to no compression, so ask for deflate like the original archive
+    with zipfile.ZipFile(buffer) as source, zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            target.writestr(
+                zipfile.ZipInfo(item.filename, FIXED_DATE.timetuple()[:6]),
+                source.read(item),
+                compress_type=zipfile.ZIP_DEFLATED
+            )
+
+
+def build_fixtures(directory: str) -> Dict[str, str]:
+    """Write the benchmark corpus to `directory`; returns name -> path"""
+    os.makedirs(directory, exist_ok=True)
+    specs = {
+        "txt": (write_txt, "lecture.txt", 20_000),
+        "pdf": (write_pdf, "lecture.pdf", 20_000),
+        "pdf_large": (write_pdf, "lecture_large.pdf", 150_000),
+        "docx": (write_docx, "lecture.docx", 20_000),
+    }
+    paths = {}
+    for name, (writer, filename, chars) in specs.items():
+        path = os.path.join(directory, filename)
+        writer(path, chars)
+        paths[name] = path
+    return paths
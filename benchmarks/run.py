@@ -0,0 +1,359 @@
+"""
+Load benchmark of the API against a local fake Gemini server
+
+Starts the fake Gemini server and the app (uvicorn, in a scratch working
+directory so its databases start empty), generates the PDF/DOCX/TXT corpus
+and drives each endpoint scenario with a fixed number of requests at a fixed
+concurrency. Reports p50/p95/p99 latency, requests per second and peak RSS
+of the server process tree per scenario as JSON.
+
+    python -m benchmarks.run --requests 200 --concurrency 16 --output bench.json
+    python -m benchmarks.run --scenarios generate-quiz --rate-limit 0.1 --malformed 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.fixtures import REPO_ROOT, build_fixtures, lecture_text
+
+# Seconds to wait for the fake server and the app to come up
+STARTUP_TIMEOUT = 60
+# How often the server's memory is sampled during a scenario
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+class Scenario:
+    """One endpoint under load; `request(i)` returns (method, path, aiohttp kwargs)"""
+
+    def __init__(self, name: str, request: Callable[[int], tuple], setup: Optional[Callable] = None):
+        self.name = name
+        self.request = request
+        self.setup = setup
+
+
+def build_scenarios(fixtures: Dict[str, str], state: dict) -> List[Scenario]:
+    files = {name: open(path, "rb").read() for name, path in fixtures.items()}
+
+    def upload(name: str, cold: bool):
+        filename = os.path.basename(fixtures[name])
+
+        def request(i: int):
+            form = aiohttp.FormData()
+            form.add_field("file", files[name], filename=filename)
+            # max_chars is part of the extraction cache key: a unique value per
+            # request forces a real parse, a fixed one measures cache hits
+            form.add_field("max_chars", str(1_000_000 + i if cold else 1_000_000))
+            return "POST", "/api/upload-file", {"data": form}
+        return request
+
+    def generate(cached: bool):
+        def request(i: int):
+            text = state["text"] if cached else f"{state['text']}\n\nVariant {i}."
+            body = {"text": text, "num_questions": 10, "regenerate": not cached}
+            return "POST", "/api/generate-quiz", {"json": body}
+        return request
+
+    async def create_quiz(session: aiohttp.ClientSession, base_url: str):
+        async with session.post(f"{base_url}/api/generate-quiz", json={"text": state["text"]}) as response:
+            response.raise_for_status()
+            state["quiz_id"] = (await response.json())["quiz_id"]
+
+    def submit(i: int):
+        answers = {str(q): "ABCD"[(i + q) % 4] for q in range(10)}
+        return "POST", f"/api/submit-answers?quiz_id={state['quiz_id']}", {"json": {"answers": answers}}
+
+    def get_quiz(i: int):
+        return "GET", f"/api/quiz/{state['quiz_id']}?answers=false", {}
+
+    return [
+        Scenario("upload-txt", upload("txt", cold=True)),
+        Scenario("upload-pdf", upload("pdf", cold=True)),
+        Scenario("upload-pdf-large", upload("pdf_large", cold=True)),
+        Scenario("upload-docx", upload("docx", cold=True)),
+        Scenario("upload-pdf-cached", upload("pdf", cold=False)),
+        Scenario("generate-quiz", generate(cached=False)),
+        Scenario("generate-quiz-cached", generate(cached=True)),
+        Scenario("submit-answers", submit, setup=create_quiz),
+        Scenario("get-quiz", get_quiz, setup=create_quiz),
+    ]
+
+
+async def run_scenario(scenario: Scenario, base_url: str, requests: int, concurrency: int, server_pid: int) -> dict:
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if scenario.setup:
+            await scenario.setup(session, base_url)
+
+        latencies: List[float] = []
+        statuses: Dict[str, int] = {}
+        counter = iter(range(requests))
+
+        async def worker():
+            for i in counter:
+                method, path, kwargs = scenario.request(i)
+                started = time.perf_counter()
+                try:
+                    async with session.request(method, base_url + path, **kwargs) as response:
+                        await response.read()
+                        status = str(response.status)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        peak_rss = [tree_rss(server_pid)]
+        sampling = asyncio.create_task(sample_rss(server_pid, peak_rss))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+        sampling.cancel()
+
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "name": scenario.name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "ok": ok,
+        "statuses": statuses,
+        "duration_s": round(duration, 3),
+        "rps": round(requests / duration, 2) if duration else None,
+        "latency_ms": latency_summary(latencies),
+        "peak_rss_mb": round(peak_rss[0] / 1024, 1) if peak_rss[0] else None
+    }
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        # Nearest-rank percentile
+        index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2)
+    }
+
+
+async def sample_rss(pid: int, peak: list):
+    while True:
+        peak[0] = max(peak[0], tree_rss(pid))
+        await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def tree_rss(pid: int) -> int:
+    """Resident memory in kB of a process and its children (extraction workers); 0 without /proc"""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                total += sum(tree_rss(int(child)) for child in f.read().split())
+    except (OSError, ValueError):
+        pass
+    return total
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_line(process: subprocess.Popen, marker: str):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        line = process.stdout.readline()
+        if not line and process.poll() is not None:
+            break
+        if marker in line:
+            return
+    raise RuntimeError(f"Process did not start: {process.args}")
+
+
+async def wait_for_http(url: str):
+    deadline = time.time() + STARTUP_TIMEOUT
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not start: {url}")
+
+
+def app_environment(gemini_port: int, keys: int) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "GEMINI_API_KEY": ",".join(f"bench-key-{i}" for i in range(keys)),
+        "GEMINI_API_ENDPOINT": f"127.0.0.1:{gemini_port}",
+        "GEMINI_MODEL": "gemini-bench",
+        # The fake server has no quota; 429s only come from --rate-limit
+        "GEMINI_RPM_PER_KEY": "1000000",
+        # Never reach the real Telegram API from a benchmark
+        "TELEGRAM_BOT_TOKEN": "",
+        "TELEGRAM_WEBHOOK_URL": "",
+    })
+    return env
+
+
+async def scrape_counters(base_url: str) -> Dict[str, float]:
+    """Gemini and parser counters from /metrics (retries, 429s, dropped output)"""
+    counters = {}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/metrics") as response:
+            if response.status != 200:
+                return counters
+            text = await response.text()
+    for line in text.splitlines():
+        if line.startswith(("testify_gemini_", "testify_quiz_parse_")) and not line.startswith("#") \
+                and "_bucket" not in line:
+            name, value = line.rsplit(" ", 1)
+            counters[name] = float(value)
+    return counters
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="testify-bench-")
+    fixtures = build_fixtures(os.path.join(workdir, "fixtures"))
+    gemini_port = args.gemini_port or free_port()
+    app_port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_gemini", "--port", str(gemini_port),
+         "--latency", str(args.latency), "--jitter", str(args.jitter),
+         "--rate-limit", str(args.rate_limit), "--malformed", str(args.malformed)],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True
+    )
+    app = None
+    try:
+        wait_for_line(fake, "listening")
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(app_port), "--log-level", "warning"],
+            cwd=workdir, env=app_environment(gemini_port, args.keys),
+            stdout=subprocess.DEVNULL if not args.verbose else None,
+            stderr=subprocess.DEVNULL if not args.verbose else None
+        )
+        await wait_for_http(f"{base_url}/health")
+
+        state = {"text": lecture_text(6000, seed=7)}
+        selected = set(args.scenarios.split(",")) if args.scenarios else None
+        results = []
+        for scenario in build_scenarios(fixtures, state):
+            if selected and scenario.name not in selected:
+                continue
+            result = await run_scenario(scenario, base_url, args.requests, args.concurrency, app.pid)
+            results.append(result)
+            latency = result["latency_ms"]
+            print(
+                f"{result['name']:<22} {result['rps']:>9} req/s  p50 {latency.get('p50')} ms"
+                f"  p95 {latency.get('p95')} ms  p99 {latency.get('p99')} ms"
+                f"  ok {result['ok']}/{result['requests']}  rss {result['peak_rss_mb']} MB",
+                file=sys.stderr
+            )
+        counters = await scrape_counters(base_url)
+    finally:
+        if app is not None:
+            app.send_signal(signal.SIGINT)
+            try:
+                app.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                app.kill()
+        fake.send_signal(signal.SIGTERM)
+        fake_stats = None
+        try:
+            output, _ = fake.communicate(timeout=10)
+            fake_stats = json.loads(output.strip().splitlines()[-1])
+        except (subprocess.TimeoutExpired, ValueError, IndexError):
+            fake.kill()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "fake_gemini": {
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "rate_limit": args.rate_limit,
+                "malformed": args.malformed,
+                "keys": args.keys,
+                "stats": fake_stats
+            }
+        },
+        "scenarios": results,
+        "counters": counters
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default="", help="Comma-separated scenario names (default: all)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake Gemini seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Share of Gemini calls failed with 429")
+    parser.add_argument("--malformed", type=float, default=0.0, help="Share of Gemini calls with broken JSON")
+    parser.add_argument("--keys", type=int, default=4, help="Fake Gemini API keys in the pool")
+    parser.add_argument("--port", type=int, default=0, help="App port (default: a free one)")
+    parser.add_argument("--gemini-port", type=int, default=0)
+    parser.add_argument("--output", default="-", help="JSON results file (default: stdout)")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep databases and fixtures")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's output")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    data = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(data)
+    else:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+
+
+if __name__ == "__main__":
+    main()